@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+
+import aiohttp
+
+from Benchmarks.run_benchmark import free_port
+from Benchmarks.synthetic_catalog import SyntheticCatalog
+from Engine import create_profile_engine, create_tables
+from ProductIngest import DatabaseFacade
+
+
+def load_catalog(path: str, catalog: SyntheticCatalog) -> None:
+    """Write the catalog to a new database at `path` in bulk batches."""
+    db_engine = create_profile_engine(path, "bulk-load")
+    create_tables(db_engine)
+    df = DatabaseFacade(db_engine)
+    nodes = list(catalog.nodes())
+    for start in range(0, len(nodes), 500):
+        df.add_batch(nodes[start : start + 500])
+    db_engine.dispose()
+
+
+def request_paths(catalog: SyntheticCatalog, distinct: int, seed: int):
+    """Return `distinct` product, listing and change feed request paths."""
+    rng = random.Random(seed)
+    paths = []
+    for _ in range(distinct):
+        kind = rng.random()
+        if kind < 0.7:
+            paths.append(
+                f"/products/{catalog.sku(rng.randrange(catalog.size))}"
+            )
+        elif kind < 0.9:
+            brand = urllib.parse.quote(
+                catalog.brand(rng.randrange(catalog.brand_count))
+            )
+            after = rng.randrange(catalog.size)
+            paths.append(f"/products?brand={brand}&after={after}&limit=50")
+        else:
+            paths.append(f"/changes?after={rng.randrange(catalog.size)}")
+    return paths
+
+
+async def run_pass(
+    base_url: str, paths: list, concurrency: int, etags: dict | None
+) -> dict:
+    """
+    Request every path with `concurrency` clients. With `etags` each request
+    revalidates the ETag seen for its path; otherwise the ETags are recorded.
+    """
+    latencies = []
+    statuses = {}
+    queue = iter(paths)
+    record = {} if etags is None else None
+
+    async def client(session):
+        for path in queue:
+            headers = {}
+            if etags is not None and path in etags:
+                headers["If-None-Match"] = etags[path]
+            started = time.perf_counter()
+            async with session.get(base_url + path, headers=headers) as r:
+                await r.read()
+            latencies.append(time.perf_counter() - started)
+            statuses[r.status] = statuses.get(r.status, 0) + 1
+            if record is not None and "ETag" in r.headers:
+                record[path] = r.headers["ETag"]
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        seconds = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "requests_per_second": len(latencies) / seconds,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "statuses": statuses,
+        "etags": record,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=(
+            "Load a synthetic catalog, serve it with CatalogService and"
+            " measure request throughput with a cold cache, a warm cache and"
+            " ETag revalidation."
+        )
+    )
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument(
+        "--distinct",
+        type=int,
+        default=5000,
+        help="distinct request paths the requests are drawn from",
+    )
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--cache-size", type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    catalog = SyntheticCatalog(args.products, args.seed)
+    rng = random.Random(args.seed)
+    distinct = request_paths(catalog, args.distinct, args.seed)
+    paths = [rng.choice(distinct) for _ in range(args.requests)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "catalog.db")
+        started = time.perf_counter()
+        load_catalog(path, catalog)
+        print(
+            f"Loaded {catalog.size} products in",
+            f"{time.perf_counter() - started:.1f}s.",
+        )
+        port = free_port()
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "CatalogService",
+                f"--database={path}",
+                f"--port={port}",
+                f"--cache-size={args.cache_size}",
+            ],
+            stdout=subprocess.DEVNULL,
+        )
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    urllib.request.urlopen(base_url + "/stats").close()
+                    break
+                except OSError:
+                    if (
+                        server.poll() is not None
+                        or time.monotonic() > deadline
+                    ):
+                        raise RuntimeError(
+                            "The catalog service did not start."
+                        )
+                    time.sleep(0.1)
+            cold = asyncio.run(
+                run_pass(base_url, paths, args.concurrency, None)
+            )
+            warm = asyncio.run(
+                run_pass(base_url, paths, args.concurrency, None)
+            )
+            revalidate = asyncio.run(
+                run_pass(base_url, paths, args.concurrency, warm["etags"])
+            )
+            with urllib.request.urlopen(base_url + "/stats") as response:
+                stats = response.read().decode()
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"{'pass':<11} {'req/s':>8} {'p50 ms':>7} {'p99 ms':>7}  statuses")
+    for name, result in (
+        ("cold", cold),
+        ("warm", warm),
+        ("revalidate", revalidate),
+    ):
+        print(
+            f"{name:<11} {result['requests_per_second']:>8.0f}",
+            f"{result['p50_ms']:>7.2f} {result['p99_ms']:>7.2f} ",
+            result["statuses"],
+        )
+    print("Service stats:", stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import func, select
+
+from Benchmarks.synthetic_catalog import SyntheticCatalog
+from Engine import create_profile_engine, create_tables
+from Models import Category, CategoryClosure, ChildCategory, Product
+from ProductIngest import DatabaseFacade
+
+
+def category_tree(depth: int, fanout: int) -> list[tuple[str, str | None]]:
+    """
+    Return `(name, parent name)` pairs of a complete tree `depth` levels
+    deep with `fanout` children per category, parents before children.
+    """
+    tree = [("Root", None)]
+    level = ["Root"]
+    for _ in range(depth - 1):
+        next_level = []
+        for parent in level:
+            for child in range(fanout):
+                name = f"{parent}/{child}"
+                tree.append((name, parent))
+                next_level.append(name)
+        level = next_level
+    return tree
+
+
+def closure_query(name: str):
+    """Products below a category through the closure, as a single join."""
+    return (
+        select(func.count(Product.product_id))
+        .join(
+            CategoryClosure,
+            CategoryClosure.descendant_id == Product.category_id,
+        )
+        .join(Category, Category.category_id == CategoryClosure.ancestor_id)
+        .where(Category.name == name)
+    )
+
+
+def recursive_query(name: str):
+    """Products below a category by walking `ChildCategory` recursively."""
+    subtree = (
+        select(Category.category_id.label("category_id"))
+        .where(Category.name == name)
+        .cte("subtree", recursive=True)
+    )
+    subtree = subtree.union_all(
+        select(ChildCategory.child_category_id).join(
+            subtree, ChildCategory.parent_category_id == subtree.c.category_id
+        )
+    )
+    return select(func.count(Product.product_id)).where(
+        Product.category_id.in_(select(subtree.c.category_id))
+    )
+
+
+def time_queries(connection, make_query, names: list[str]) -> tuple:
+    """Run the query for every name and return the timing and row counts."""
+    counts = []
+    started = time.perf_counter()
+    for name in names:
+        counts.append(connection.execute(make_query(name)).scalar())
+    return time.perf_counter() - started, counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare closure and recursive category subtree queries."
+    )
+    parser.add_argument("--depth", type=int, default=12)
+    parser.add_argument("--fanout", type=int, default=2)
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    tree = category_tree(args.depth, args.fanout)
+    catalog = SyntheticCatalog(args.products, args.seed)
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        db_engine = create_profile_engine(
+            os.path.join(directory, "benchmark.db"), "bulk-load"
+        )
+        create_tables(db_engine)
+        df = DatabaseFacade(db_engine)
+        started = time.perf_counter()
+        batch = []
+        for index, node in enumerate(catalog.nodes()):
+            # Walk the tree top down first so every category gets linked.
+            name, parent = tree[index % len(tree)]
+            node["category"] = [
+                {
+                    "name": name,
+                    "parent": {"name": parent} if parent else None,
+                    "children": [],
+                }
+            ]
+            batch.append(node)
+            if len(batch) >= args.batch_size:
+                df.add_batch(batch)
+                batch = []
+        if batch:
+            df.add_batch(batch)
+        load_seconds = time.perf_counter() - started
+        with db_engine.connect() as connection:
+            closure_rows = connection.execute(
+                select(func.count()).select_from(CategoryClosure)
+            ).scalar()
+            max_depth = connection.execute(
+                select(func.max(CategoryClosure.depth))
+            ).scalar()
+            names = [
+                tree[rng.randrange(len(tree))][0]
+                for _ in range(args.queries - 1)
+            ] + ["Root"]
+            closure_seconds, closure_counts = time_queries(
+                connection, closure_query, names
+            )
+            recursive_seconds, recursive_counts = time_queries(
+                connection, recursive_query, names
+            )
+        db_engine.dispose()
+    if closure_counts != recursive_counts:
+        raise SystemExit("Closure and recursive subtree counts differ.")
+    print(
+        f"{len(tree)} categories, {max_depth + 1} levels,",
+        f"{closure_rows} closure rows, {args.products} products",
+        f"loaded in {load_seconds:.2f}s.",
+    )
+    print(f"{'query':<10} {'seconds':>8} {'queries/s':>10}")
+    for label, seconds in (
+        ("closure", closure_seconds),
+        ("recursive", recursive_seconds),
+    ):
+        print(f"{label:<10} {seconds:>8.3f} {len(names) / seconds:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
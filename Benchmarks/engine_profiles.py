@@ -0,0 +1,101 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import select
+
+from Benchmarks.synthetic_catalog import SyntheticCatalog
+from Engine import (
+    PROFILES,
+    create_profile_engine,
+    create_tables,
+    create_indexes,
+)
+from Models import Product
+from ProductIngest import DatabaseFacade
+
+
+def run_profile(
+    profile: str,
+    catalog: SyntheticCatalog,
+    batch_size: int,
+    defer_indexes: bool,
+    lookups: int,
+) -> dict:
+    """Load the catalog under one engine profile and time reads after it."""
+    with tempfile.TemporaryDirectory() as directory:
+        db_engine = create_profile_engine(
+            os.path.join(directory, "benchmark.db"), profile
+        )
+        create_tables(db_engine, defer_indexes)
+        df = DatabaseFacade(db_engine)
+        started = time.perf_counter()
+        batch = []
+        for node in catalog.nodes():
+            batch.append(node)
+            if len(batch) >= batch_size:
+                df.add_batch(batch)
+                batch = []
+        if batch:
+            df.add_batch(batch)
+        load_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        if defer_indexes:
+            create_indexes(db_engine)
+        index_seconds = time.perf_counter() - started
+        rng = random.Random(0)
+        skus = [
+            catalog.sku(rng.randrange(catalog.size)) for _ in range(lookups)
+        ]
+        started = time.perf_counter()
+        with db_engine.connect() as connection:
+            for sku in skus:
+                connection.execute(
+                    select(Product.product_id).where(Product.sku == sku)
+                ).scalar()
+        lookup_seconds = time.perf_counter() - started
+        db_engine.dispose()
+    return {
+        "profile": profile,
+        "defer_indexes": defer_indexes,
+        "products": catalog.size,
+        "load_seconds": load_seconds,
+        "index_seconds": index_seconds,
+        "products_per_second": catalog.size / (load_seconds + index_seconds),
+        "lookups_per_second": lookups / lookup_seconds,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare the SQLite engine profiles on a synthetic load."
+    )
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    catalog = SyntheticCatalog(args.products, args.seed)
+    runs = [(profile, False) for profile in PROFILES]
+    runs += [("bulk-load", True), ("bulk-load-unsafe", True)]
+    print(
+        f"{'profile':<18} {'deferred':<9} {'load s':>8} {'index s':>8}",
+        f"{'products/s':>11} {'lookups/s':>10}",
+    )
+    for profile, defer_indexes in runs:
+        result = run_profile(
+            profile, catalog, args.batch_size, defer_indexes, args.lookups
+        )
+        print(
+            f"{profile:<18} {str(defer_indexes):<9}",
+            f"{result['load_seconds']:>8.2f} {result['index_seconds']:>8.2f}",
+            f"{result['products_per_second']:>11.0f}",
+            f"{result['lookups_per_second']:>10.0f}",
+        )
+
+
+if __name__ == "__main__":
+    main()
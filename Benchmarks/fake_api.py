@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import random
+import re
+
+from aiohttp import web
+
+from Benchmarks.synthetic_catalog import SyntheticCatalog
+
+
+class FakeApi:
+    """
+    Local stand-in for the Combisteel GraphQL endpoint serving a synthetic
+    catalog. It implements `getProductListing` with `first`/`after` paging,
+    returns only the node fields named in the query, waits `latency` seconds
+    (with `jitter`) per request and answers a `throttle_rate` fraction of
+    requests with a 429 and a `Retry-After` of `retry_after` seconds. With
+    `compress` responses are compressed as the request's `Accept-Encoding`
+    allows.
+    """
+
+    def __init__(
+        self,
+        catalog: SyntheticCatalog,
+        latency: float = 0.05,
+        jitter: float = 0.2,
+        throttle_rate: float = 0.0,
+        retry_after: float = 1.0,
+        seed: int = 0,
+        compress: bool = False,
+    ):
+        """Set up the server state for the given catalog."""
+        self.catalog = catalog
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.compress = compress
+        self._rng = random.Random(seed)
+        self._fields = {}
+        self.requests = 0
+        self.throttles = 0
+        self.products = 0
+
+    def _selected_fields(self, query: str) -> list[str]:
+        """Return the node fields named in the query, caching per query."""
+        if query not in self._fields:
+            node = self.catalog.node(0)
+            self._fields[query] = [
+                name for name in node if re.search(rf"\b{name}\b", query)
+            ]
+        return self._fields[query]
+
+    async def graphql(self, request: web.Request) -> web.Response:
+        """Answer a `getProductListing` query."""
+        self.requests += 1
+        body = await request.json()
+        query = body.get("query") or ""
+        if "getProductListing" not in query:
+            return web.json_response(
+                {"errors": [{"message": "Only getProductListing is served"}]}
+            )
+        if self._rng.random() < self.throttle_rate:
+            self.throttles += 1
+            return web.Response(
+                status=429, headers={"Retry-After": str(self.retry_after)}
+            )
+        variables = body.get("variables") or {}
+        first = int(variables.get("first") or 100)
+        after = int(variables.get("after") or 0)
+        latency = self.latency * (1 + self._rng.uniform(0, self.jitter))
+        await asyncio.sleep(latency)
+        fields = self._selected_fields(query)
+        edges = []
+        for node in self.catalog.nodes(after, after + first):
+            edges.append({"node": {name: node[name] for name in fields}})
+        self.products += len(edges)
+        listing = {"totalCount": self.catalog.size, "edges": edges}
+        response = web.json_response({"data": {"getProductListing": listing}})
+        if self.compress:
+            response.enable_compression()
+        return response
+
+    async def stats(self, request: web.Request) -> web.Response:
+        """Return the request, throttle and product counters."""
+        return web.json_response(
+            {
+                "requests": self.requests,
+                "throttles": self.throttles,
+                "products": self.products,
+            }
+        )
+
+    def application(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post("/", self.graphql)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve a synthetic catalog as a local GraphQL API."
+    )
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="seconds per request"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.2, help="latency jitter fraction"
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        type=float,
+        default=0.0,
+        help="fraction of requests answered with a 429",
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=float,
+        default=1.0,
+        help="Retry-After seconds sent with each 429",
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="compress responses as the request's Accept-Encoding allows",
+    )
+    args = parser.parse_args(argv)
+
+    api = FakeApi(
+        SyntheticCatalog(args.products, args.seed),
+        args.latency,
+        args.jitter,
+        args.throttle_rate,
+        args.retry_after,
+        args.seed,
+        args.compress,
+    )
+    print(f"Serving {args.products} products on {args.host}:{args.port}.")
+    web.run_app(api.application(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
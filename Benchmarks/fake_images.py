@@ -0,0 +1,172 @@
+import argparse
+import asyncio
+import random
+import re
+import zlib
+
+from aiohttp import web
+
+_RANGE = re.compile(r"bytes=(\d+)-$")
+
+
+class FakeImages:
+    """
+    Local stand-in for the Combisteel image host. Every path is served
+    deterministic bytes derived from it, about `size` bytes long, except
+    that a `shared_rate` fraction of paths get one of a few placeholder
+    assets, as happens with "no image" pictures. `Range: bytes=N-` requests
+    are answered with a 206. Each request waits `latency` seconds; a
+    `throttle_rate` fraction is answered with a 429 and a `cut_rate`
+    fraction has its connection dropped halfway through the body.
+    """
+
+    def __init__(
+        self,
+        size: int = 50000,
+        latency: float = 0.02,
+        shared_rate: float = 0.1,
+        throttle_rate: float = 0.0,
+        cut_rate: float = 0.0,
+        retry_after: float = 1.0,
+        seed: int = 0,
+    ):
+        """Set up the server state."""
+        self.size = size
+        self.latency = latency
+        self.shared_rate = shared_rate
+        self.throttle_rate = throttle_rate
+        self.cut_rate = cut_rate
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self.requests = 0
+        self.ranges = 0
+        self.throttles = 0
+        self.cuts = 0
+        self.bytes = 0
+
+    def content(self, path: str) -> bytes:
+        """Return the bytes served for `path`."""
+        key = zlib.crc32(path.encode())
+        if key % 1000 < self.shared_rate * 1000:
+            key %= 5
+        rng = random.Random(key)
+        size = self.size // 2 + rng.randrange(self.size)
+        return rng.randbytes(size)
+
+    async def image(self, request: web.Request) -> web.StreamResponse:
+        """Serve the asset at the request path, or the requested range."""
+        self.requests += 1
+        if self._rng.random() < self.throttle_rate:
+            self.throttles += 1
+            return web.Response(
+                status=429, headers={"Retry-After": str(self.retry_after)}
+            )
+        await asyncio.sleep(self.latency)
+        body = self.content(request.path)
+        start = 0
+        if "Range" in request.headers:
+            match = _RANGE.match(request.headers["Range"])
+            if not match or int(match.group(1)) >= len(body):
+                return web.Response(
+                    status=416,
+                    headers={"Content-Range": f"bytes */{len(body)}"},
+                )
+            start = int(match.group(1))
+            self.ranges += 1
+        response = web.StreamResponse(
+            status=206 if start else 200,
+            headers={"Content-Type": "image/jpeg", "Accept-Ranges": "bytes"},
+        )
+        if start:
+            response.headers[
+                "Content-Range"
+            ] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+        response.content_length = len(body) - start
+        await response.prepare(request)
+        if self._rng.random() < self.cut_rate:
+            self.cuts += 1
+            middle = start + (len(body) - start) // 2
+            await response.write(body[start:middle])
+            self.bytes += middle - start
+            request.transport.close()
+            return response
+        await response.write(body[start:])
+        self.bytes += len(body) - start
+        await response.write_eof()
+        return response
+
+    async def stats(self, request: web.Request) -> web.Response:
+        """Return the request, range, throttle and cut counters."""
+        return web.json_response(
+            {
+                "requests": self.requests,
+                "ranges": self.ranges,
+                "throttles": self.throttles,
+                "cuts": self.cuts,
+                "bytes": self.bytes,
+            }
+        )
+
+    def application(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/stats", self.stats)
+        app.router.add_get("/{path:.+}", self.image)
+        return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve deterministic image assets for any path."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument(
+        "--size", type=int, default=50000, help="mean asset size in bytes"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="seconds per request"
+    )
+    parser.add_argument(
+        "--shared-rate",
+        type=float,
+        default=0.1,
+        help="fraction of paths served a shared placeholder asset",
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        type=float,
+        default=0.0,
+        help="fraction of requests answered with a 429",
+    )
+    parser.add_argument(
+        "--cut-rate",
+        type=float,
+        default=0.0,
+        help="fraction of responses cut off halfway through the body",
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=float,
+        default=1.0,
+        help="Retry-After seconds sent with each 429",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    images = FakeImages(
+        args.size,
+        args.latency,
+        args.shared_rate,
+        args.throttle_rate,
+        args.cut_rate,
+        args.retry_after,
+        args.seed,
+    )
+    print(f"Serving images on {args.host}:{args.port}.")
+    web.run_app(
+        images.application(), host=args.host, port=args.port, print=None
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from sqlalchemy import update
+
+from Benchmarks.catalog_service import load_catalog
+from Benchmarks.run_benchmark import free_port
+from Benchmarks.synthetic_catalog import SyntheticCatalog
+from Engine import create_profile_engine
+from ImageMirror import ImageMirror
+from Models import Image
+from RateLimiter import RateLimiter
+
+
+def store_size(store: str) -> tuple[int, int]:
+    """Return the number and total size of the files in the asset store."""
+    files = size = 0
+    for directory, subdirectories, names in os.walk(store):
+        if directory == os.path.join(store, "partial"):
+            continue
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(directory, name))
+    return files, size
+
+
+def run_pass(db_engine, store: str, base_url: str, args) -> dict:
+    """Mirror every pending image and return the pass's figures."""
+    mirror = ImageMirror(
+        db_engine,
+        store,
+        base_url,
+        args.concurrency,
+        RateLimiter(args.rate, burst=args.concurrency, max_rate=args.rate),
+    )
+    pending = len(mirror.pending())
+    started = time.perf_counter()
+    stats = mirror.run()
+    seconds = time.perf_counter() - started
+    return {"pending": pending, "seconds": seconds, **stats}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=(
+            "Load a synthetic catalog and mirror its images from a local"
+            " image server: a cold pass, a pass with nothing changed and a"
+            " pass after some images' modification dates change."
+        )
+    )
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--size", type=int, default=50000)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--cut-rate", type=float, default=0.05)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=1000.0)
+    parser.add_argument(
+        "--changed",
+        type=float,
+        default=0.05,
+        help="fraction of images given a new modification date",
+    )
+    args = parser.parse_args(argv)
+
+    catalog = SyntheticCatalog(args.products, args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "catalog.db")
+        store = os.path.join(directory, "store")
+        load_catalog(path, catalog)
+        port = free_port()
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "Benchmarks.fake_images",
+                f"--port={port}",
+                f"--size={args.size}",
+                f"--latency={args.latency}",
+                f"--cut-rate={args.cut_rate}",
+                f"--throttle-rate={args.throttle_rate}",
+                "--retry-after=0.1",
+                f"--seed={args.seed}",
+            ],
+            stdout=subprocess.DEVNULL,
+        )
+        base_url = f"http://127.0.0.1:{port}"
+        db_engine = create_profile_engine(path)
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    urllib.request.urlopen(base_url + "/stats").close()
+                    break
+                except OSError:
+                    if (
+                        server.poll() is not None
+                        or time.monotonic() > deadline
+                    ):
+                        raise RuntimeError("The image server did not start.")
+                    time.sleep(0.1)
+            passes = [("cold", run_pass(db_engine, store, base_url, args))]
+            passes.append(
+                ("unchanged", run_pass(db_engine, store, base_url, args))
+            )
+            with db_engine.begin() as connection:
+                connection.execute(
+                    update(Image)
+                    .where(Image.image_id % round(1 / args.changed) == 0)
+                    .values(modification_date=Image.modification_date + 1)
+                )
+            passes.append(
+                ("changed", run_pass(db_engine, store, base_url, args))
+            )
+            files, size = store_size(store)
+            with urllib.request.urlopen(base_url + "/stats") as response:
+                stats = json.load(response)
+        finally:
+            db_engine.dispose()
+            server.terminate()
+            server.wait()
+
+    print(
+        f"{'pass':<10} {'pending':>8} {'images/s':>9} {'MiB/s':>7}",
+        f"{'resumed':>8} {'deduped':>8} {'failed':>7}",
+    )
+    for name, result in passes:
+        seconds = result["seconds"] or float("inf")
+        print(
+            f"{name:<10} {result['pending']:>8}",
+            f"{result['downloads'] / seconds:>9.0f}",
+            f"{result['bytes'] / 1048576 / seconds:>7.1f}",
+            f"{result['resumed']:>8} {result['deduplicated']:>8}",
+            f"{result['failed']:>7}",
+        )
+    print(f"Store: {files} files, {size / 1048576:.1f} MiB.")
+    print("Image server stats:", stats)
+
+
+if __name__ == "__main__":
+    main()
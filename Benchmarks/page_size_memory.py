@@ -0,0 +1,88 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=(
+            "Compare peak RSS and throughput across API page sizes, with and"
+            " without streaming, each run in a fresh process."
+        )
+    )
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument(
+        "--page-sizes",
+        type=lambda text: [int(size) for size in text.split(",")],
+        default=[100, 500, 1000, 2500, 5000],
+        help="comma-separated page sizes (default: 100,500,1000,2500,5000)",
+    )
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument(
+        "--memory-budget",
+        type=float,
+        metavar="MB",
+        help="also pass --memory-budget to each run",
+    )
+    parser.add_argument(
+        "--output",
+        default="benchmark-results.jsonl",
+        help="JSON lines file each result is appended to",
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        results_path = os.path.join(directory, "results.jsonl")
+        for page_size in args.page_sizes:
+            for stream in (False, True):
+                ingest_args = [
+                    "--bulk",
+                    "--page-size",
+                    str(page_size),
+                    "--fixed-page-size",
+                ]
+                if stream:
+                    ingest_args.append("--stream")
+                if args.memory_budget:
+                    ingest_args += ["--memory-budget", str(args.memory_budget)]
+                subprocess.run(
+                    [
+                        sys.executable,
+                        "-m",
+                        "Benchmarks.run_benchmark",
+                        f"--products={args.products}",
+                        f"--latency={args.latency}",
+                        f"--output={results_path}",
+                        "--",
+                        *ingest_args,
+                    ],
+                    check=True,
+                    stdout=subprocess.DEVNULL,
+                )
+        with open(results_path) as results_file:
+            results = [json.loads(line) for line in results_file]
+    with open(args.output, "a") as output:
+        for result in results:
+            output.write(json.dumps(result) + "\n")
+
+    print(
+        f"{'page size':>9} {'stream':<7} {'peak RSS MiB':>12}",
+        f"{'products/s':>11} {'requests':>9}",
+    )
+    for result in results:
+        ingest_args = result["ingest_args"]
+        page_size = ingest_args[ingest_args.index("--page-size") + 1]
+        rss = result["peak_rss_mb"]
+        print(
+            f"{page_size:>9} {str('--stream' in ingest_args):<7}",
+            f"{rss:>12.1f}" if rss is not None else f"{'n/a':>12}",
+            f"{result['products_per_second']:>11.0f}",
+            f"{result['api']['requests']:>9}",
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+
+from Benchmarks.synthetic_catalog import SyntheticCatalog
+from Engine import create_indexes, create_profile_engine, create_tables
+from Models import Product
+from ProductIngest import DatabaseFacade
+
+
+def like_search(db_engine, words: str, limit: int) -> list:
+    """Find products containing every word with `LIKE` substring scans."""
+    columns = [
+        Product.sku,
+        Product.ean,
+        Product.title,
+        Product.description,
+        Product.long_description,
+    ]
+    stmt = select(Product)
+    for word in words.split():
+        stmt = stmt.where(
+            or_(*(column.like(f"%{word}%") for column in columns))
+        )
+    with Session(db_engine) as session:
+        return list(session.scalars(stmt.limit(limit)))
+
+
+def search_words(catalog: SyntheticCatalog, count: int, seed: int) -> list:
+    """Return SKU, category and title word searches over the catalog."""
+    rng = random.Random(seed)
+    words = []
+    for _ in range(count):
+        index = rng.randrange(catalog.size)
+        kind = rng.random()
+        if kind < 0.4:
+            words.append(catalog.sku(index))
+        elif kind < 0.7:
+            node = catalog.node(index)
+            words.append(node["category"][0]["name"].split()[-1])
+        else:
+            words.append(f"synthetic product {index}")
+    return words
+
+
+def time_searches(search, words: list, limit: int) -> tuple[float, int]:
+    """Return the searches per second and the total number of results."""
+    results = 0
+    started = time.perf_counter()
+    for query in words:
+        results += len(search(query, limit))
+    return len(words) / (time.perf_counter() - started), results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=(
+            "Compare keyword searches through the FTS5 index with LIKE"
+            " substring scans on a synthetic catalog."
+        )
+    )
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--searches", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    catalog = SyntheticCatalog(args.products, args.seed)
+    words = search_words(catalog, args.searches, args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        db_engine = create_profile_engine(
+            os.path.join(directory, "benchmark.db"), "bulk-load"
+        )
+        create_tables(db_engine, defer_indexes=True)
+        df = DatabaseFacade(db_engine)
+        started = time.perf_counter()
+        batch = []
+        for node in catalog.nodes():
+            batch.append(node)
+            if len(batch) >= 500:
+                df.add_batch(batch)
+                batch = []
+        if batch:
+            df.add_batch(batch)
+        load_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        create_indexes(db_engine)
+        index_seconds = time.perf_counter() - started
+        print(
+            f"Loaded {catalog.size} products in {load_seconds:.2f}s,",
+            f"indexes and search index built in {index_seconds:.2f}s.",
+        )
+        fts_rate, fts_results = time_searches(
+            df.search_products, words, args.limit
+        )
+        like_rate, like_results = time_searches(
+            lambda query, limit: like_search(db_engine, query, limit),
+            words,
+            args.limit,
+        )
+        db_engine.dispose()
+    print(f"{'search':<6} {'searches/s':>11} {'results':>8}")
+    print(f"{'fts5':<6} {fts_rate:>11.1f} {fts_results:>8}")
+    print(f"{'like':<6} {like_rate:>11.1f} {like_results:>8}")
+    print(f"FTS5 is {fts_rate / like_rate:.0f}x faster than LIKE.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+class StatementCounter:
+    """Count the SQL statements run by every engine, by leading keyword."""
+
+    def __init__(self):
+        self.statements = Counter()
+        self.parameter_sets = 0
+
+    def __enter__(self):
+        event.listen(Engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, "before_cursor_execute", self._count)
+
+    def _count(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        keyword = statement.lstrip().split(None, 1)[0].upper()
+        self.statements[keyword] += 1
+        self.parameter_sets += len(parameters) if executemany else 1
+
+    @property
+    def total(self) -> int:
+        return sum(self.statements.values())
+
+
+def peak_rss_mb() -> float | None:
+    """Return the peak resident set size of this process in MiB."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def fake_api(args, port: int):
+    """Run `Benchmarks.fake_api` in a subprocess until the block exits."""
+    command = [
+        sys.executable,
+        "-m",
+        "Benchmarks.fake_api",
+        f"--products={args.products}",
+        f"--seed={args.seed}",
+        f"--port={port}",
+        f"--latency={args.latency}",
+        f"--throttle-rate={args.throttle_rate}",
+        f"--retry-after={args.retry_after}",
+    ]
+    if args.compress:
+        command.append("--compress")
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), 0.5).close()
+                break
+            except OSError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("The fake API did not start.")
+                time.sleep(0.1)
+        yield f"http://127.0.0.1:{port}/"
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> dict:
+    """Run one ingest against a fresh fake API and database."""
+    with tempfile.TemporaryDirectory() as directory, fake_api(
+        args, args.port or free_port()
+    ) as url:
+        os.environ["API_URL"] = url
+        os.environ["API_KEY"] = "benchmark"
+        os.environ["DATABASE_NAME"] = os.path.join(directory, "benchmark.db")
+        # The engine is created from the environment on first import.
+        import ProductIngest
+
+        output = io.StringIO()
+        with StatementCounter() as counter:
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(output):
+                summary = ProductIngest.main(args.ingest_args)
+            wall_seconds = time.perf_counter() - started
+        ProductIngest.engine.dispose()
+        with urllib.request.urlopen(url + "stats") as response:
+            api_stats = json.load(response)
+    products = summary["products"]
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "catalog": {"products": args.products, "seed": args.seed},
+        "api": {
+            "latency": args.latency,
+            "throttle_rate": args.throttle_rate,
+            "retry_after": args.retry_after,
+            "compress": args.compress,
+            **api_stats,
+        },
+        "ingest_args": args.ingest_args,
+        "products": products,
+        "wall_seconds": wall_seconds,
+        "products_per_second": products / wall_seconds,
+        "sql_statements": dict(counter.statements),
+        "sql_statements_per_product": counter.total / max(products, 1),
+        "sql_parameter_sets": counter.parameter_sets,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": {
+            stats["stage"]: stats["busy_seconds"]
+            for stats in summary["stages"]
+        },
+        "summary": summary,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=(
+            "Run ProductIngest against a local fake API serving a synthetic"
+            " catalog and record throughput, SQL and memory figures."
+        ),
+        epilog=(
+            "Arguments after `--` are passed to ProductIngest, e.g."
+            " `-- --bulk --concurrency 4`."
+        ),
+    )
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="have the fake API compress its responses",
+    )
+    parser.add_argument(
+        "--port", type=int, default=0, help="fake API port (default: any)"
+    )
+    parser.add_argument(
+        "--output",
+        default="benchmark-results.jsonl",
+        help="JSON lines file each result is appended to",
+    )
+    parser.add_argument("ingest_args", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+    if args.ingest_args[:1] == ["--"]:
+        args.ingest_args = args.ingest_args[1:]
+
+    result = run(args)
+    with open(args.output, "a") as output:
+        output.write(json.dumps(result) + "\n")
+    print(
+        f"{result['products']} products in {result['wall_seconds']:.2f}s",
+        f"({result['products_per_second']:.0f} products/s),",
+        f"{result['sql_statements_per_product']:.2f} SQL statements",
+        "per product.",
+    )
+    if result["peak_rss_mb"] is not None:
+        print(f"Peak RSS {result['peak_rss_mb']:.1f} MiB.")
+    for stage, seconds in result["stages"].items():
+        print(f"{stage} stage: {seconds:.3f}s busy.")
+    print(f"Result appended to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
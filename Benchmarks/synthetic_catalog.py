@@ -0,0 +1,145 @@
+import random
+
+CREATED = 1700000000
+
+
+def _image(path: str, rng: random.Random) -> dict:
+    modified = CREATED + rng.randrange(0, 30000000)
+    return {
+        "creationDate": CREATED,
+        "filename": path.rsplit("/", 1)[-1],
+        "fullpath": path,
+        "mimetype": "image/jpeg",
+        "modificationDate": modified,
+    }
+
+
+class SyntheticCatalog:
+    """
+    Deterministic catalog of `size` products shaped like `getProductListing`
+    nodes. Every node is derived from its index and the seed alone, so any
+    slice of a catalog of millions of products can be produced on demand.
+    Brands, categories and images are reused across products in roughly the
+    proportions seen in the real feed.
+    """
+
+    def __init__(self, size: int, seed: int = 0):
+        """Set up the shared brand, category and image pools."""
+        self.size = size
+        self.seed = seed
+        self.brand_count = max(5, size // 250)
+        self.top_category_count = max(3, min(40, size // 500))
+        self.category_count = max(10, min(2000, size // 50))
+        self.shared_image_count = max(10, size // 20)
+
+    def brand(self, index: int) -> str:
+        return f"Brand {index:05d}"
+
+    def category(self, index: int) -> dict:
+        """Return the category at `index` with its parent and children."""
+        top = self.top_category_count
+        if index < top:
+            parent = None
+        else:
+            parent = {"name": self._category_name(index % top)}
+        children = [
+            {"name": self._category_name(child)}
+            for child in range(top + index, self.category_count, top)
+        ][:5]
+        return {
+            "name": self._category_name(index),
+            "parent": parent,
+            "children": children if index < top else [],
+        }
+
+    def _category_name(self, index: int) -> str:
+        if index < self.top_category_count:
+            return f"Category {index:04d}"
+        return f"Category {index % self.top_category_count:04d}.{index:05d}"
+
+    def sku(self, index: int) -> str:
+        return f"{7000 + index // 10000}.{index % 10000:04d}"
+
+    def node(self, index: int) -> dict:
+        """Return the product node at `index`."""
+        rng = random.Random(self.seed * 1000003 + index)
+        extra_images = {}
+        for number in range(rng.randrange(0, 5)):
+            if rng.random() < 0.3:
+                shared = rng.randrange(self.shared_image_count)
+                path = f"/shared/image-{shared:06d}.jpg"
+                # Shared images carry the same metadata on every product.
+                image = _image(path, random.Random(self.seed + shared))
+            else:
+                path = f"/products/{index:07d}/extra-{number}.jpg"
+                image = _image(path, rng)
+            # A product lists each of its images once.
+            extra_images.setdefault(path, {"image": image})
+        children = []
+        if rng.random() < 0.05:
+            for _ in range(rng.randrange(1, 4)):
+                children.append({"sku": self.sku(rng.randrange(self.size))})
+        width = rng.randrange(200, 2000, 10)
+        height = rng.randrange(200, 2200, 10)
+        depth = rng.randrange(200, 1000, 10)
+        category = self.category(
+            rng.randrange(self.top_category_count, self.category_count)
+        )
+        title = f"Synthetic {category['name']} product {index}"
+        return {
+            "sku": self.sku(index),
+            "description": title,
+            "brand": self.brand(
+                int(rng.paretovariate(1.2)) % self.brand_count
+            ),
+            "category": [category],
+            "depth": depth,
+            "ean": f"{5000000000000 + index}",
+            "dimensions": f"{height}x{width}x{depth}(HxWxD)",
+            "height": height,
+            "grossWeight": round(rng.uniform(1, 300), 2),
+            "extraImages": list(extra_images.values()),
+            "length": None,
+            "longDescription": f"{title}. " * rng.randrange(1, 20),
+            "netWeight": round(rng.uniform(1, 250), 2),
+            "title": title,
+            "ukPrice": round(rng.uniform(5, 15000), 2),
+            "ukStock": rng.randrange(0, 500),
+            "width": width,
+            "children": children,
+            "defaultImage": _image(f"/products/{index:07d}/default.jpg", rng),
+            "creationDate": CREATED + index,
+        }
+
+    def nodes(self, start: int = 0, stop: int | None = None):
+        """Yield the product nodes from `start` up to `stop`."""
+        stop = self.size if stop is None else min(stop, self.size)
+        for index in range(start, stop):
+            yield self.node(index)
+
+
+def main(argv=None):
+    import argparse
+    import json
+    import sys
+
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic catalog as JSON lines of API nodes."
+    )
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write (default: stdout)")
+    args = parser.parse_args(argv)
+
+    catalog = SyntheticCatalog(args.products, args.seed)
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for node in catalog.nodes():
+            output.write(json.dumps(node) + "\n")
+    finally:
+        if args.output:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
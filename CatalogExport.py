@@ -0,0 +1,257 @@
+from datetime import datetime
+import argparse
+import csv
+import json
+import sys
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased
+
+from CatalogService import PRODUCT_COLUMNS
+from Engine import create_profile_engine, database_name
+from Models import Brand, Category, Image, Product, ProductImage
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # only needed for --format parquet
+    pyarrow = None
+
+FORMATS = ("csv", "jsonl", "parquet")
+
+# Separator of the extra image paths in a CSV cell.
+CSV_LIST_SEPARATOR = "|"
+
+
+def export_statement(since: int | None = None):
+    """
+    Return the flat product feed: every product still in the catalog with
+    its brand name, category name, default image path and a JSON array of
+    its other image paths, or every product updated at or after `since`,
+    including those retired since then. The rows come back in index order,
+    so the database never has to sort or hold the whole feed.
+    """
+    default_image = aliased(Image)
+    extra_images = (
+        select(func.json_group_array(Image.fullpath))
+        .join(ProductImage, ProductImage.image_id == Image.image_id)
+        .where(
+            ProductImage.product_id == Product.product_id,
+            Image.image_id.is_not(Product.default_image_id),
+        )
+        .scalar_subquery()
+    )
+    stmt = (
+        select(
+            *PRODUCT_COLUMNS,
+            Brand.name.label("brand"),
+            Category.name.label("category"),
+            default_image.fullpath.label("default_image"),
+            extra_images.label("extra_images"),
+        )
+        .select_from(Product)
+        .outerjoin(Brand, Brand.brand_id == Product.brand_id)
+        .outerjoin(Category, Category.category_id == Product.category_id)
+        .outerjoin(
+            default_image, default_image.image_id == Product.default_image_id
+        )
+    )
+    if since is None:
+        return stmt.where(Product.retired_at.is_(None)).order_by(
+            Product.product_id
+        )
+    return stmt.where(Product.updated_at >= since).order_by(
+        Product.updated_at, Product.product_id
+    )
+
+
+def export_rows(db_engine, since: int | None = None, chunk_size: int = 1000):
+    """
+    Yield the feed in lists of up to `chunk_size` row dicts, stepping the
+    database cursor a chunk at a time so memory stays constant.
+    """
+    with db_engine.connect() as connection:
+        result = connection.execution_options(yield_per=chunk_size).execute(
+            export_statement(since)
+        )
+        for partition in result.partitions():
+            rows = []
+            for row in partition:
+                values = row._asdict()
+                values["extra_images"] = json.loads(values["extra_images"])
+                rows.append(values)
+            yield rows
+
+
+class CsvWriter:
+    """Write feed rows as CSV with a header line."""
+
+    def __init__(self, output, columns: list[str]):
+        self._writer = csv.DictWriter(output, columns)
+        self._writer.writeheader()
+
+    def write(self, rows: list[dict]) -> None:
+        for row in rows:
+            row["extra_images"] = CSV_LIST_SEPARATOR.join(row["extra_images"])
+        self._writer.writerows(rows)
+
+    def close(self) -> None:
+        pass
+
+
+class JsonLinesWriter:
+    """Write feed rows as one JSON object per line."""
+
+    def __init__(self, output, columns: list[str]):
+        self._output = output
+
+    def write(self, rows: list[dict]) -> None:
+        self._output.writelines(
+            json.dumps(row, separators=(",", ":")) + "\n" for row in rows
+        )
+
+    def close(self) -> None:
+        pass
+
+
+class ParquetWriter:
+    """Write feed rows to a Parquet file, one row group per chunk."""
+
+    def __init__(self, output, columns: list[str]):
+        types = {int: pyarrow.int64(), float: pyarrow.float64()}
+        fields = [
+            (column.key, types.get(column.type.python_type, pyarrow.string()))
+            for column in PRODUCT_COLUMNS
+        ]
+        fields += [
+            ("brand", pyarrow.string()),
+            ("category", pyarrow.string()),
+            ("default_image", pyarrow.string()),
+            ("extra_images", pyarrow.list_(pyarrow.string())),
+        ]
+        self._schema = pyarrow.schema(fields)
+        self._writer = pyarrow.parquet.ParquetWriter(output, self._schema)
+
+    def write(self, rows: list[dict]) -> None:
+        self._writer.write_table(
+            pyarrow.Table.from_pylist(rows, schema=self._schema)
+        )
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+WRITERS = {
+    "csv": CsvWriter,
+    "jsonl": JsonLinesWriter,
+    "parquet": ParquetWriter,
+}
+
+
+def export(
+    db_engine,
+    output,
+    output_format: str = "csv",
+    since: int | None = None,
+    chunk_size: int = 1000,
+) -> int:
+    """Write the feed to `output` in the given format and return its rows."""
+    columns = [column.key for column in PRODUCT_COLUMNS] + [
+        "brand",
+        "category",
+        "default_image",
+        "extra_images",
+    ]
+    writer = WRITERS[output_format](output, columns)
+    count = 0
+    try:
+        for rows in export_rows(db_engine, since, chunk_size):
+            writer.write(rows)
+            count += len(rows)
+    finally:
+        writer.close()
+    return count
+
+
+def parse_since(text: str) -> int:
+    """Parse a Unix timestamp or an ISO 8601 date or time."""
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return int(datetime.fromisoformat(text).timestamp())
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"not a Unix timestamp or ISO 8601 date: {text!r}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=(
+            "Export the catalog as a flat feed of products with their brand,"
+            " category and image paths."
+        )
+    )
+    parser.add_argument(
+        "--database",
+        default=database_name,
+        help="SQLite database file (default: DATABASE_NAME)",
+    )
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument(
+        "--output",
+        help="file to write (default: stdout, not for parquet)",
+    )
+    parser.add_argument(
+        "--since",
+        type=parse_since,
+        help=(
+            "only export products updated at or after this Unix timestamp"
+            " or ISO 8601 date"
+        ),
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=1000,
+        help="rows read from the database at a time (default: 1000)",
+    )
+    args = parser.parse_args(argv)
+    if args.format == "parquet":
+        if pyarrow is None:
+            parser.error("--format parquet needs pyarrow to be installed")
+        if not args.output:
+            parser.error("--format parquet needs --output")
+
+    db_engine = create_profile_engine(
+        args.database, "serving", pragmas={"query_only": "ON"}
+    )
+    if args.format == "parquet":
+        output = args.output
+    elif args.output:
+        output = open(args.output, "w", newline="")
+    else:
+        output = sys.stdout
+    started = time.perf_counter()
+    try:
+        rows = export(
+            db_engine, output, args.format, args.since, args.chunk_size
+        )
+    finally:
+        if args.output and args.format != "parquet":
+            output.close()
+    seconds = time.perf_counter() - started
+    db_engine.dispose()
+    # Keep stdout for the feed itself.
+    print(
+        f"Exported {rows} products in {seconds:.2f}s",
+        f"({rows / seconds if seconds else 0:.0f} rows/sec).",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
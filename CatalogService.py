@@ -0,0 +1,365 @@
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import asyncio
+import hashlib
+import json
+
+from aiohttp import web
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import aliased
+
+from Engine import create_profile_engine, database_name
+from LookupCache import LookupCache
+from Models import (
+    Brand,
+    Category,
+    CategoryClosure,
+    ChildProduct,
+    Image,
+    Product,
+    ProductImage,
+)
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# Product columns served by the API, in the order they are listed.
+PRODUCT_COLUMNS = [
+    Product.product_id,
+    Product.sku,
+    Product.title,
+    Product.description,
+    Product.long_description,
+    Product.ean,
+    Product.uk_price,
+    Product.uk_stock,
+    Product.width,
+    Product.height,
+    Product.depth,
+    Product.length,
+    Product.dimensions,
+    Product.gross_weight,
+    Product.net_weight,
+    Product.creation_date,
+    Product.updated_at,
+    Product.retired_at,
+]
+
+
+class CatalogService:
+    """
+    Read-only HTTP API over the ingested catalog: products by SKU, product
+    listings filtered by brand or category subtree, and a feed of products
+    changed since a given time. Listings page by keyset on `product_id` (the
+    feed on `updated_at, product_id`) so every page is an index range scan.
+
+    Queries run on a thread pool over a `serving` engine whose connections
+    are `query_only`, so the service never writes to the database. Response
+    bodies are kept in an LRU cache that is cleared whenever another
+    connection has committed to the database, as reported by SQLite's
+    `PRAGMA data_version`, and are sent with an ETag so that clients can
+    revalidate with `If-None-Match`.
+    """
+
+    def __init__(self, engine, cache_size: int | None = 10000, threads=8):
+        """Set up a service reading through `engine`."""
+        self._engine = engine
+        self._executor = ThreadPoolExecutor(threads, "catalog-query")
+        self._responses = LookupCache("responses", cache_size)
+        self._version_connection = None
+        self._generation = None
+        self.requests = 0
+        self.not_modified = 0
+        self.invalidations = 0
+        default_image = aliased(Image)
+        self._listing = (
+            select(
+                *PRODUCT_COLUMNS,
+                Brand.name.label("brand"),
+                Category.name.label("category"),
+                default_image.fullpath.label("default_image"),
+            )
+            .select_from(Product)
+            .outerjoin(Brand, Brand.brand_id == Product.brand_id)
+            .outerjoin(Category, Category.category_id == Product.category_id)
+            .outerjoin(
+                default_image,
+                default_image.image_id == Product.default_image_id,
+            )
+        )
+
+    def _check_generation(self) -> int:
+        """
+        Return the database's data version, clearing the response cache if
+        another connection has committed since the last check.
+        """
+        if self._version_connection is None:
+            self._version_connection = self._engine.raw_connection()
+        cursor = self._version_connection.cursor()
+        cursor.execute("PRAGMA data_version")
+        version = cursor.fetchone()[0]
+        cursor.close()
+        if version != self._generation:
+            if self._generation is not None:
+                self.invalidations += 1
+            self._generation = version
+            self._responses.clear()
+        return version
+
+    def product(self, sku: str) -> dict | None:
+        """Return the product with the given SKU, its images and children."""
+        stmt = self._listing.where(Product.sku == sku)
+        with self._engine.connect() as connection:
+            row = connection.execute(stmt).first()
+            if row is None:
+                return None
+            product = row._asdict()
+            product["images"] = list(
+                connection.scalars(
+                    select(Image.fullpath)
+                    .join(
+                        ProductImage, ProductImage.image_id == Image.image_id
+                    )
+                    .where(ProductImage.product_id == row.product_id)
+                    .order_by(Image.image_id)
+                )
+            )
+            product["children"] = list(
+                connection.scalars(
+                    select(Product.sku)
+                    .join(
+                        ChildProduct,
+                        ChildProduct.child_product_id == Product.product_id,
+                    )
+                    .where(ChildProduct.parent_product_id == row.product_id)
+                    .order_by(Product.product_id)
+                )
+            )
+        return product
+
+    def products(
+        self,
+        brand: str | None = None,
+        category: str | None = None,
+        after: int = 0,
+        limit: int = DEFAULT_LIMIT,
+    ) -> dict:
+        """
+        Return up to `limit` products with an id above `after`, optionally
+        of the named brand and in the named category or its descendants,
+        along with the cursor of the next page. Retired products are left
+        out; they are still served by SKU and in the change feed.
+        """
+        stmt = self._listing.where(
+            Product.product_id > after, Product.retired_at.is_(None)
+        )
+        if brand is not None:
+            stmt = stmt.where(
+                Product.brand_id
+                == select(Brand.brand_id)
+                .where(Brand.name == brand)
+                .scalar_subquery()
+            )
+        if category is not None:
+            stmt = stmt.where(
+                Product.category_id.in_(
+                    select(CategoryClosure.descendant_id)
+                    .join(
+                        Category,
+                        Category.category_id == CategoryClosure.ancestor_id,
+                    )
+                    .where(Category.name == category)
+                )
+            )
+        stmt = stmt.order_by(Product.product_id).limit(limit + 1)
+        with self._engine.connect() as connection:
+            items = [row._asdict() for row in connection.execute(stmt)]
+        next_page = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_page = {"after": items[-1]["product_id"]}
+        return {"items": items, "next": next_page}
+
+    def changes(
+        self, since: int = 0, after: int = 0, limit: int = DEFAULT_LIMIT
+    ) -> dict:
+        """
+        Return up to `limit` products updated at or after `since`, oldest
+        first, resuming after product `after` among those updated at exactly
+        `since`, along with the cursor of the next page.
+        """
+        stmt = (
+            self._listing.where(
+                tuple_(Product.updated_at, Product.product_id)
+                > tuple_(since, after)
+            )
+            .order_by(Product.updated_at, Product.product_id)
+            .limit(limit + 1)
+        )
+        with self._engine.connect() as connection:
+            items = [row._asdict() for row in connection.execute(stmt)]
+        next_page = None
+        if len(items) > limit:
+            items = items[:limit]
+            last = items[-1]
+            next_page = {
+                "since": last["updated_at"],
+                "after": last["product_id"],
+            }
+        return {"items": items, "next": next_page}
+
+    async def _respond(self, request: web.Request, query, *args):
+        """
+        Answer a request with the JSON result of `query(*args)`, run on the
+        query thread pool unless the response is cached.
+        """
+        self.requests += 1
+        generation = self._check_generation()
+        key = request.path_qs
+        hit, cached = self._responses.lookup(key)
+        if cached is None:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._executor, query, *args)
+            if result is None:
+                raise web.HTTPNotFound()
+            body = json.dumps(result, separators=(",", ":")).encode()
+            etag = f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+            cached = (body, etag)
+            # A commit while the query ran may have cleared the cache.
+            if generation == self._generation:
+                self._responses.put(key, cached)
+        body, etag = cached
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if_none_match = request.headers.get("If-None-Match", "")
+        tags = {
+            tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+        }
+        if etag in tags or "*" in tags:
+            self.not_modified += 1
+            return web.Response(status=304, headers=headers)
+        return web.Response(
+            body=body, content_type="application/json", headers=headers
+        )
+
+    @staticmethod
+    def _int_param(request: web.Request, name: str, default: int) -> int:
+        try:
+            return int(request.query.get(name, default))
+        except ValueError:
+            raise web.HTTPBadRequest(text=f"{name} must be an integer")
+
+    def _limit(self, request: web.Request) -> int:
+        limit = self._int_param(request, "limit", DEFAULT_LIMIT)
+        if not 1 <= limit <= MAX_LIMIT:
+            raise web.HTTPBadRequest(
+                text=f"limit must be between 1 and {MAX_LIMIT}"
+            )
+        return limit
+
+    async def get_product(self, request: web.Request) -> web.Response:
+        """`GET /products/{sku}`"""
+        return await self._respond(
+            request, self.product, request.match_info["sku"]
+        )
+
+    async def get_products(self, request: web.Request) -> web.Response:
+        """`GET /products?brand=&category=&after=&limit=`"""
+        return await self._respond(
+            request,
+            self.products,
+            request.query.get("brand"),
+            request.query.get("category"),
+            self._int_param(request, "after", 0),
+            self._limit(request),
+        )
+
+    async def get_changes(self, request: web.Request) -> web.Response:
+        """`GET /changes?since=&after=&limit=`"""
+        return await self._respond(
+            request,
+            self.changes,
+            self._int_param(request, "since", 0),
+            self._int_param(request, "after", 0),
+            self._limit(request),
+        )
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        """Return the request counters and response cache statistics."""
+        return web.json_response(
+            {
+                "requests": self.requests,
+                "not_modified": self.not_modified,
+                "invalidations": self.invalidations,
+                "cache": self._responses.stats(),
+            }
+        )
+
+    def close(self) -> None:
+        """Release the data version connection and the query threads."""
+        if self._version_connection is not None:
+            self._version_connection.close()
+            self._version_connection = None
+        self._executor.shutdown()
+
+    def application(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/products", self.get_products)
+        app.router.add_get("/products/{sku}", self.get_product)
+        app.router.add_get("/changes", self.get_changes)
+        app.router.add_get("/stats", self.get_stats)
+
+        async def close(app):
+            self.close()
+
+        app.on_cleanup.append(close)
+        return app
+
+
+def create_service_engine(name: str, threads: int = 8):
+    """
+    Create a `serving` engine for the named database whose connections
+    refuse to write, with a connection per query thread.
+    """
+    return create_profile_engine(
+        name,
+        "serving",
+        pragmas={"query_only": "ON"},
+        pool_size=threads + 1,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve the ingested catalog as a read-only HTTP API."
+    )
+    parser.add_argument(
+        "--database",
+        default=database_name,
+        help="SQLite database file (default: DATABASE_NAME)",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=10000,
+        help="responses kept in the LRU cache (default: 10000)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=8,
+        help="threads running database queries (default: 8)",
+    )
+    args = parser.parse_args(argv)
+
+    db_engine = create_service_engine(args.database, args.threads)
+    service = CatalogService(db_engine, args.cache_size, args.threads)
+    print(f"Serving {args.database} on {args.host}:{args.port}.")
+    web.run_app(
+        service.application(), host=args.host, port=args.port, print=None
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,189 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.schema import CreateColumn
 from dotenv import load_dotenv
 from os import getenv
 
 load_dotenv()
 
+# PRAGMAs applied to every new connection, by engine profile.
+PROFILES = {
+    "default": {
+        "foreign_keys": "ON",
+    },
+    # Single writer loading as fast as possible. WAL with synchronous=NORMAL
+    # can lose the last commits on power loss but never corrupts the file.
+    "bulk-load": {
+        "foreign_keys": "ON",
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -262144,  # 256 MiB
+        "mmap_size": 1073741824,  # 1 GiB
+        "temp_store": "MEMORY",
+    },
+    # As bulk-load, but without fsyncs. A crash of the OS may corrupt the
+    # database, so only use this for loads that can be rerun from scratch.
+    "bulk-load-unsafe": {
+        "foreign_keys": "ON",
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -262144,
+        "mmap_size": 1073741824,
+        "temp_store": "MEMORY",
+    },
+    # Many concurrent readers alongside an occasional writer.
+    "serving": {
+        "foreign_keys": "ON",
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -65536,  # 64 MiB
+        "mmap_size": 268435456,  # 256 MiB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+}
+
+
+def create_profile_engine(
+    name: str, profile: str = "default", pragmas: dict | None = None, **kwargs
+):
+    """
+    Create an engine for the named SQLite database whose connections are
+    configured with the PRAGMAs of the given profile, followed by any extra
+    `pragmas`.
+    """
+    pragmas = {**PROFILES[profile], **(pragmas or {})}
+    db_engine = create_engine(f"sqlite:///{name}", **kwargs)
+
+    @event.listens_for(db_engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+        cursor.close()
+
+    return db_engine.execution_options(sqlite_profile=profile)
+
+
 database_name = getenv("DATABASE_NAME", "database.db")
-engine = create_engine(f"sqlite:///{database_name}")
+engine = create_profile_engine(
+    database_name, getenv("DATABASE_PROFILE", "default")
+)
 
 
-def create_tables(db_engine=engine):
+def create_tables(db_engine=engine, defer_indexes: bool = False):
     """
-    Create the tables for all `Base` derived models.
+    Create the tables for all `Base` derived models. With `defer_indexes`
+    their secondary indexes and the search index triggers are dropped so
+    that a bulk load does not have to maintain them, and `create_indexes`
+    must be called once it is done.
     """
     from Models import Base
 
     Base.metadata.create_all(db_engine)
+    add_missing_columns(db_engine)
+    create_triggers(db_engine)
+    if defer_indexes:
+        drop_indexes(db_engine)
+    else:
+        create_indexes(db_engine)
+
+
+def create_triggers(db_engine=engine):
+    """
+    Create any missing triggers declared alongside the models, and start
+    the price and stock history if it is empty.
+    """
+    from Models import PRICE_STOCK_HISTORY_SEED, TRIGGERS
+
+    with db_engine.begin() as connection:
+        for trigger in TRIGGERS:
+            connection.exec_driver_sql(trigger)
+        connection.exec_driver_sql(PRICE_STOCK_HISTORY_SEED)
+
+
+def drop_indexes(db_engine=engine):
+    """
+    Drop the secondary indexes declared by the models and the triggers that
+    keep the search index in step with `products`.
+    """
+    from Models import Base, SEARCH_TRIGGERS
+
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(db_engine, checkfirst=True)
+    with db_engine.begin() as connection:
+        for trigger in SEARCH_TRIGGERS:
+            connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {trigger}")
+
+
+def create_indexes(db_engine=engine):
+    """
+    Create any missing secondary indexes declared by the models and the
+    search index, and refresh the query planner statistics.
+    """
+    from Models import Base
+
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db_engine, checkfirst=True)
+    create_search_index(db_engine)
+    with db_engine.connect() as connection:
+        connection.execute(text("PRAGMA optimize"))
+
+
+def create_search_index(db_engine=engine) -> bool:
+    """
+    Create the full-text search index over `products` and its triggers if
+    they are missing. An index that is new, or whose triggers were missing
+    (e.g. dropped for a bulk load), is rebuilt from `products` in one pass.
+    Return whether it was rebuilt.
+    """
+    from Models import SEARCH_TABLE, SEARCH_TRIGGERS
+
+    names = {"products_fts", *SEARCH_TRIGGERS}
+    with db_engine.begin() as connection:
+        existing = set(
+            connection.exec_driver_sql(
+                "SELECT name FROM sqlite_master"
+                " WHERE type IN ('table', 'trigger')"
+            ).scalars()
+        )
+        connection.exec_driver_sql(SEARCH_TABLE)
+        for trigger in SEARCH_TRIGGERS.values():
+            connection.exec_driver_sql(trigger)
+        rebuild = not names <= existing
+        if rebuild:
+            rebuild_search_index(connection)
+    return rebuild
+
+
+def rebuild_search_index(connection) -> None:
+    """Rebuild the whole full-text search index from `products`."""
+    connection.exec_driver_sql(
+        "INSERT INTO products_fts (products_fts) VALUES ('rebuild')"
+    )
+
+
+def add_missing_columns(db_engine=engine):
+    """
+    Add any nullable columns that the models have gained since the tables were
+    created, as `create_all` leaves existing tables untouched.
+    """
+    from Models import Base
+
+    inspector = inspect(db_engine)
+    with db_engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {
+                column["name"] for column in inspector.get_columns(table.name)
+            }
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                ddl = CreateColumn(column).compile(dialect=db_engine.dialect)
+                connection.execute(
+                    text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+                )
 
 
 def create_test_entities():
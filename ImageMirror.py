@@ -0,0 +1,336 @@
+from dotenv import load_dotenv
+from os import getenv
+from typing import NamedTuple
+import aiohttp
+import argparse
+import asyncio
+import hashlib
+import os
+import time
+
+from sqlalchemy import bindparam, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from Engine import create_profile_engine, create_tables, database_name
+from Models import Image, ImageAsset
+from RateLimiter import RateLimiter
+
+load_dotenv()
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _range_total(headers) -> int | None:
+    """Return the full size from a `Content-Range: bytes */N` header."""
+    value = headers.get("Content-Range", "")
+    if value.startswith("bytes */") and value[8:].isdigit():
+        return int(value[8:])
+    return None
+
+
+class PendingImage(NamedTuple):
+    """An image whose asset is missing or older than its metadata."""
+
+    image_id: int
+    fullpath: str
+    modification_date: int | None
+
+
+class ImageMirror:
+    """
+    Copies the assets of the `images` rows from `base_url` into a local
+    content-addressed store, where each file is named by the SHA-256 of its
+    bytes so an asset shared by several images is kept once.
+
+    Only images without an `ImageAsset`, or whose `modification_date` has
+    changed since it was fetched, are downloaded. Downloads share one pooled
+    client session, run `concurrency` at a time and are paced by a
+    `RateLimiter`. Each download is written to a partial file named after
+    the image and its modification date; a download cut off midway is
+    resumed from the bytes already received with a `Range` request, whether
+    on retry or in the next run.
+    """
+
+    def __init__(
+        self,
+        db_engine,
+        store: str,
+        base_url: str,
+        concurrency: int = 8,
+        rate_limiter: RateLimiter | None = None,
+        retries: int = 3,
+        batch_size: int = 100,
+    ):
+        """Set up a mirror of the images in `db_engine` under `store`."""
+        self._engine = db_engine
+        self._store = store
+        self._partial_dir = os.path.join(store, "partial")
+        self._base_url = base_url.rstrip("/")
+        self._concurrency = concurrency
+        self._rate_limiter = rate_limiter or RateLimiter()
+        self._retries = retries
+        self._batch_size = batch_size
+        self._fetched = []
+        self.downloads = 0
+        self.resumed = 0
+        self.deduplicated = 0
+        self.failed = 0
+        self.bytes = 0
+
+    def pending(self) -> list[PendingImage]:
+        """Return the images whose asset is missing or out of date."""
+        stmt = (
+            select(Image.image_id, Image.fullpath, Image.modification_date)
+            .outerjoin(ImageAsset, ImageAsset.image_id == Image.image_id)
+            .where(
+                (ImageAsset.image_id.is_(None))
+                | ImageAsset.modification_date.is_distinct_from(
+                    Image.modification_date
+                )
+            )
+            .order_by(Image.image_id)
+        )
+        with self._engine.connect() as connection:
+            return [PendingImage(*row) for row in connection.execute(stmt)]
+
+    def path(self, content_hash: str) -> str:
+        """Return where the asset with the given hash is stored."""
+        return os.path.join(
+            self._store, content_hash[:2], content_hash[2:4], content_hash
+        )
+
+    def _partial_path(self, image: PendingImage) -> str:
+        return os.path.join(
+            self._partial_dir,
+            f"{image.image_id}-{image.modification_date}.part",
+        )
+
+    def _store_partial(self, partial: str) -> tuple[str, int, bool]:
+        """
+        Move a complete download into the store under its content hash,
+        dropping it if the store already holds the same bytes. Return the
+        hash, the size and whether the bytes were already stored.
+        """
+        with open(partial, "rb") as file:
+            content_hash = hashlib.file_digest(file, "sha256").hexdigest()
+        size = os.path.getsize(partial)
+        path = self.path(content_hash)
+        if os.path.exists(path):
+            os.remove(partial)
+            return content_hash, size, True
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(partial, path)
+        return content_hash, size, False
+
+    async def _download(
+        self, session: aiohttp.ClientSession, image: PendingImage
+    ) -> str:
+        """
+        Download an image to its partial file, resuming from whatever part
+        of it is already there, and return the partial file's path. Failed
+        and throttled requests count towards the retries alike.
+        """
+        url = self._base_url + image.fullpath
+        partial = self._partial_path(image)
+        failures = 0
+        while True:
+            offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            await self._rate_limiter.acquire_async()
+            started = time.perf_counter()
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 429:
+                        self._rate_limiter.on_throttle(
+                            RateLimiter.retry_after(response.headers)
+                        )
+                        failures += 1
+                        if failures > self._retries:
+                            response.raise_for_status()
+                        continue
+                    if response.status == 416:
+                        if offset == _range_total(response.headers):
+                            # The partial file already holds the whole asset.
+                            self._rate_limiter.on_success(
+                                time.perf_counter() - started
+                            )
+                            return partial
+                        # The partial file is not a prefix of the asset.
+                        os.remove(partial)
+                        continue
+                    response.raise_for_status()
+                    if response.status == 206:
+                        self.resumed += 1
+                        mode = "ab"
+                    else:
+                        mode = "wb"
+                    with open(partial, mode) as file:
+                        async for chunk in response.content.iter_chunked(
+                            CHUNK_SIZE
+                        ):
+                            file.write(chunk)
+                            self.bytes += len(chunk)
+                self._rate_limiter.on_success(time.perf_counter() - started)
+                return partial
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                failures += 1
+                if failures > self._retries:
+                    raise
+
+    def _flush(self) -> None:
+        """Record the assets fetched since the last flush."""
+        if not self._fetched:
+            return
+        stmt = sqlite_insert(ImageAsset).values(
+            image_id=bindparam("image_id"),
+            content_hash=bindparam("content_hash"),
+            size=bindparam("size"),
+            modification_date=bindparam("modification_date"),
+            fetched_at=bindparam("fetched_at"),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ImageAsset.image_id],
+            set_={
+                "content_hash": stmt.excluded.content_hash,
+                "size": stmt.excluded.size,
+                "modification_date": stmt.excluded.modification_date,
+                "fetched_at": stmt.excluded.fetched_at,
+            },
+        )
+        with Session(self._engine) as session, session.begin():
+            session.connection().execute(stmt, self._fetched)
+        self._fetched = []
+
+    async def _worker(self, session: aiohttp.ClientSession, queue) -> None:
+        for image in queue:
+            try:
+                partial = await self._download(session, image)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                self.failed += 1
+                print(f"Failed to fetch {image.fullpath}: {exc}")
+                continue
+            content_hash, size, stored = await asyncio.to_thread(
+                self._store_partial, partial
+            )
+            self.downloads += 1
+            self.deduplicated += stored
+            self._fetched.append(
+                {
+                    "image_id": image.image_id,
+                    "content_hash": content_hash,
+                    "size": size,
+                    "modification_date": image.modification_date,
+                    "fetched_at": int(time.time()),
+                }
+            )
+            if len(self._fetched) >= self._batch_size:
+                self._flush()
+
+    async def mirror(self, images: list[PendingImage] | None = None) -> dict:
+        """Fetch the given images, or all pending ones, and return stats."""
+        if images is None:
+            images = self.pending()
+        os.makedirs(self._partial_dir, exist_ok=True)
+        queue = iter(images)
+        connector = aiohttp.TCPConnector(limit=self._concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            try:
+                await asyncio.gather(
+                    *(
+                        self._worker(session, queue)
+                        for _ in range(self._concurrency)
+                    )
+                )
+            finally:
+                self._flush()
+        return self.stats()
+
+    def run(self) -> dict:
+        """Fetch every pending image."""
+        return asyncio.run(self.mirror())
+
+    def stats(self) -> dict:
+        """Return the download counters and the rate limiter's state."""
+        return {
+            "downloads": self.downloads,
+            "resumed": self.resumed,
+            "deduplicated": self.deduplicated,
+            "failed": self.failed,
+            "bytes": self.bytes,
+            "rate_limiter": self._rate_limiter.stats(),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=(
+            "Download the image assets referenced by the database into a"
+            " local content-addressed store."
+        )
+    )
+    parser.add_argument(
+        "--database",
+        default=database_name,
+        help="SQLite database file (default: DATABASE_NAME)",
+    )
+    parser.add_argument(
+        "--store",
+        default=getenv("IMAGE_STORE", "images"),
+        help="directory of the asset store (default: IMAGE_STORE or images)",
+    )
+    parser.add_argument(
+        "--base-url",
+        default=getenv("IMAGE_BASE_URL"),
+        help="URL the image paths are relative to (default: IMAGE_BASE_URL)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="downloads in flight at once (default: 8)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=10.0,
+        help="initial requests per second, adapted as the run goes",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="times a failed or throttled download is retried before giving up",
+    )
+    args = parser.parse_args(argv)
+    if not args.base_url:
+        parser.error("--base-url or IMAGE_BASE_URL is required")
+
+    db_engine = create_profile_engine(args.database)
+    create_tables(db_engine)
+    mirror = ImageMirror(
+        db_engine,
+        args.store,
+        args.base_url,
+        args.concurrency,
+        RateLimiter(
+            args.rate, burst=args.concurrency, max_rate=max(50.0, args.rate)
+        ),
+        args.retries,
+    )
+    images = mirror.pending()
+    print(f"{len(images)} images to fetch.")
+    started = time.perf_counter()
+    stats = asyncio.run(mirror.mirror(images))
+    seconds = time.perf_counter() - started
+    print(
+        f"Fetched {stats['downloads']} images",
+        f"({stats['bytes'] / 1048576:.1f} MiB) in {seconds:.1f}s:",
+        f"{stats['resumed']} resumed, {stats['deduplicated']} already stored,",
+        f"{stats['failed']} failed.",
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    main()
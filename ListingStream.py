@@ -0,0 +1,87 @@
+import codecs
+import json
+import re
+
+
+_EDGES = re.compile(r'"edges"\s*:\s*\[')
+_TOTAL_COUNT = re.compile(r'"totalCount"\s*:\s*(\d+)')
+
+
+class ListingError(ValueError):
+    """Raised when a streamed response holds no `getProductListing` edges."""
+
+
+class ListingDecoder:
+    """
+    Incremental decoder for a `getProductListing` response body. Bytes are
+    fed in as they arrive and each edge's node is returned as soon as its
+    closing brace has been read, so a page never has to be held in memory
+    as a whole, either as text or as decoded dicts.
+    """
+
+    def __init__(self):
+        """Set up a decoder waiting for the start of the response."""
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._state = "prefix"
+        self.total_count = None
+        self.nodes = 0
+        self.bytes = 0
+
+    def _read_total_count(self, text: str) -> None:
+        if self.total_count is None:
+            match = _TOTAL_COUNT.search(text)
+            if match:
+                self.total_count = int(match.group(1))
+
+    def feed(self, data: bytes) -> list[dict]:
+        """Decode the next chunk of the body and return any complete nodes."""
+        self.bytes += len(data)
+        self._buffer += self._text.decode(data)
+        nodes = []
+        if self._state == "prefix":
+            match = _EDGES.search(self._buffer)
+            if not match:
+                return nodes
+            self._read_total_count(self._buffer[: match.start()])
+            self._buffer = self._buffer[match.end() :]
+            self._state = "edges"
+        if self._state == "edges":
+            buffer = self._buffer
+            position = 0
+            length = len(buffer)
+            while True:
+                while position < length and buffer[position] in " \t\r\n,":
+                    position += 1
+                if position == length:
+                    break
+                if buffer[position] == "]":
+                    self._state = "suffix"
+                    position += 1
+                    break
+                try:
+                    edge, end = self._json.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # The edge continues in a chunk that has not arrived.
+                    break
+                nodes.append(edge["node"])
+                position = end
+            self._buffer = buffer[position:]
+            self.nodes += len(nodes)
+        return nodes
+
+    def close(self) -> None:
+        """
+        Finish decoding, reading a `totalCount` sent after the edges. Raise
+        `ListingError` with the response's errors if it held no edges.
+        """
+        self._buffer += self._text.decode(b"", final=True)
+        if self._state == "prefix":
+            try:
+                errors = json.loads(self._buffer).get("errors")
+            except ValueError:
+                errors = None
+            raise ListingError(errors or "Response holds no product edges.")
+        self._read_total_count(self._buffer)
+        self._buffer = ""
@@ -0,0 +1,84 @@
+from collections import OrderedDict
+
+
+class LookupCache:
+    """
+    Bounded least-recently-used map from a natural key (name, fullpath, sku)
+    to a database row, with hit/miss counters.
+
+    Once warmed with every row of its table the cache is `complete`, so a key
+    that is not present is known not to exist in the database either. Evicting
+    an entry gives that guarantee up and lookups fall back to the database.
+    """
+
+    def __init__(self, name: str, max_entries: int | None = None):
+        """Set up an empty cache holding at most `max_entries` entries."""
+        self.name = name
+        self.max_entries = max_entries
+        self.complete = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, key) -> tuple[bool, object]:
+        """
+        Return `(hit, value)` for the given key. A hit with a `None` value
+        means the key is known to be absent from the database.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, self._entries[key]
+        if self.complete:
+            self.hits += 1
+            return True, None
+        self.misses += 1
+        return False, None
+
+    def put(self, key, value) -> None:
+        """Insert or refresh the given key, evicting the oldest if full."""
+        if self.max_entries == 0:
+            self.complete = False
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if self.max_entries and len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+            self.complete = False
+
+    def clear(self) -> None:
+        """Drop every entry, keeping the counters."""
+        self._entries.clear()
+        self.complete = False
+
+    def load(self, items, total: int) -> None:
+        """
+        Replace the contents with the given `(key, value)` pairs, read from a
+        table holding `total` rows. The first value seen for a key is kept.
+        """
+        self._entries.clear()
+        self.complete = True
+        for key, value in items:
+            if key not in self._entries:
+                self.put(key, value)
+            if self.max_entries is not None and len(self) >= self.max_entries:
+                break
+        self.complete = self.complete and len(self) >= total
+
+    def stats(self) -> dict:
+        """Return the size and hit/miss counters of the cache."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "complete": self.complete,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
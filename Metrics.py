@@ -0,0 +1,308 @@
+from collections import Counter
+from contextlib import contextmanager
+from threading import Event, Lock, Thread, get_ident
+import json
+import re
+import sys
+import time
+
+from sqlalchemy import event
+
+
+_TABLE_PATTERNS = [
+    re.compile(r"^\s*INSERT\s+(?:OR\s+\w+\s+)?INTO\s+\"?(\w+)", re.I),
+    re.compile(r"^\s*UPDATE\s+(?:OR\s+\w+\s+)?\"?(\w+)", re.I),
+    re.compile(r"^\s*DELETE\s+FROM\s+\"?(\w+)", re.I),
+    re.compile(r"\bFROM\s+\"?(\w+)", re.I),
+    re.compile(r"^\s*PRAGMA\s+(?:\w+\.)?(\w+)", re.I),
+    re.compile(
+        r"^\s*(?:CREATE|DROP)\s+(?:UNIQUE\s+)?\w+\s+"
+        r"(?:IF\s+(?:NOT\s+)?EXISTS\s+)?\"?(\w+)",
+        re.I,
+    ),
+]
+
+
+def statement_key(statement: str) -> tuple[str, str]:
+    """Return the operation and main table of a SQL statement."""
+    operation = statement.lstrip().split(None, 1)[0].lower()
+    for pattern in _TABLE_PATTERNS:
+        match = pattern.search(statement)
+        if match:
+            return operation, match.group(1)
+    return operation, ""
+
+
+class TimerStats:
+    """Count, total and maximum of a repeatedly timed operation."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "seconds": self.seconds,
+            "max_seconds": self.max_seconds,
+        }
+
+
+class StatementStats(TimerStats):
+    """Timer stats of a kind of SQL statement, with its parameter sets."""
+
+    def __init__(self):
+        super().__init__()
+        self.parameter_sets = 0
+
+    def as_dict(self) -> dict:
+        return {**super().as_dict(), "parameter_sets": self.parameter_sets}
+
+
+class Metrics:
+    """
+    Thread-safe counters and timers for a single run: SQL statements by
+    operation and table, named timers (API pages, requests, rate limiter
+    waits, pipeline stages) and plain counters. The collected figures can be
+    reported as a dict, a JSON file or a Prometheus text format file.
+    """
+
+    def __init__(self):
+        """Set up empty counters."""
+        self._lock = Lock()
+        self._statement_keys = {}
+        self.sql = {}
+        self.timers = {}
+        self.counters = Counter()
+        self.started = time.time()
+
+    def instrument_engine(self, engine) -> None:
+        """Count and time every statement executed through `engine`."""
+        if event.contains(engine, "before_cursor_execute", self._before):
+            return
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def _before(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    def _after(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        seconds = time.perf_counter() - conn.info["metrics_started"].pop()
+        rows = len(parameters) if executemany else 1
+        with self._lock:
+            key = self._statement_keys.get(statement)
+            if key is None:
+                key = self._statement_keys[statement] = statement_key(
+                    statement
+                )
+            stats = self.sql.get(key)
+            if stats is None:
+                stats = self.sql[key] = StatementStats()
+            stats.observe(seconds)
+            stats.parameter_sets += rows
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Record one timing of the named operation."""
+        with self._lock:
+            stats = self.timers.get(name)
+            if stats is None:
+                stats = self.timers[name] = TimerStats()
+            stats.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Time the enclosed block as one observation of `name`."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def timed(self, name: str, function):
+        """Wrap `function` so that every call is timed as `name`."""
+
+        def wrapper(*args, **kwargs):
+            with self.timer(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    def timed_iter(self, name: str, iterable):
+        """Yield from `iterable`, timing how long each item takes to get."""
+        items = iter(iterable)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                self.observe(name, time.perf_counter() - started)
+                yield item
+        finally:
+            close = getattr(items, "close", None)
+            if close:
+                close()
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += value
+
+    def report(self) -> dict:
+        """Return every counter and timer as a JSON-serialisable dict."""
+        with self._lock:
+            return {
+                "started": self.started,
+                "seconds": time.time() - self.started,
+                "sql": [
+                    {
+                        "operation": operation,
+                        "table": table,
+                        **stats.as_dict(),
+                    }
+                    for (operation, table), stats in sorted(
+                        self.sql.items(), key=lambda item: -item[1].seconds
+                    )
+                ],
+                "timers": {
+                    name: stats.as_dict()
+                    for name, stats in sorted(self.timers.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def write_json(self, path: str) -> None:
+        with open(path, "w") as output:
+            json.dump(self.report(), output, indent=2)
+
+    def prometheus(self, prefix: str = "combisteel_ingest") -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        report = self.report()
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(
+                    f'{label}="{text}"' for label, text in labels.items()
+                )
+                lines.append(
+                    f"{prefix}_{name}{suffix}{{{label_text}}} {value}"
+                )
+
+        sql_labels = [
+            ({"operation": row["operation"], "table": row["table"]}, row)
+            for row in report["sql"]
+        ]
+        family(
+            "sql_statements_total",
+            "counter",
+            "SQL statements executed.",
+            [("", labels, row["count"]) for labels, row in sql_labels],
+        )
+        family(
+            "sql_parameter_sets_total",
+            "counter",
+            "Parameter sets sent with SQL statements.",
+            [
+                ("", labels, row["parameter_sets"])
+                for labels, row in sql_labels
+            ],
+        )
+        family(
+            "sql_seconds_total",
+            "counter",
+            "Time spent executing SQL statements.",
+            [("", labels, row["seconds"]) for labels, row in sql_labels],
+        )
+        timers = report["timers"].items()
+        family(
+            "timer_seconds",
+            "summary",
+            "Timed operations.",
+            [
+                (suffix, {"name": name}, stats[key])
+                for name, stats in timers
+                for suffix, key in (("_count", "count"), ("_sum", "seconds"))
+            ],
+        )
+        family(
+            "timer_max_seconds",
+            "gauge",
+            "Longest single timed operation.",
+            [
+                ("", {"name": name}, stats["max_seconds"])
+                for name, stats in timers
+            ],
+        )
+        family(
+            "events_total",
+            "counter",
+            "Counted events.",
+            [
+                ("", {"name": name}, value)
+                for name, value in report["counters"].items()
+            ],
+        )
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        with open(path, "w") as output:
+            output.write(self.prometheus())
+
+
+class SamplingProfiler:
+    """
+    Sample the Python stacks of the other threads every `interval` seconds
+    on a background thread and count them, for a low overhead view of where
+    a whole run spends its time. Stacks are written in the collapsed format
+    read by flame graph tools.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        """Set up a stopped profiler."""
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = Event()
+        self._thread = None
+
+    def _run(self) -> None:
+        own = get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename}:{code.co_name}")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self._thread = Thread(
+            target=self._run, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def write(self, path: str) -> None:
+        """Write the sampled stacks, one `stack count` line each."""
+        with open(path, "w") as output:
+            for stack, samples in self.samples.most_common():
+                output.write(f"{stack} {samples}\n")
@@ -1,11 +1,10 @@
 from typing import Optional
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index, text
 from sqlalchemy.orm import (
     DeclarativeBase,
     Mapped,
     mapped_column,
     relationship,
-    validates,
 )
 
 
@@ -15,6 +14,15 @@ class Base(DeclarativeBase):
 
 class Product(Base):
     __tablename__ = "products"
+    # Only retired products are indexed, so the index stays small and is
+    # never chosen to drive a listing of the active ones.
+    __table_args__ = (
+        Index(
+            "ix_products_retired_at",
+            "retired_at",
+            sqlite_where=text("retired_at IS NOT NULL"),
+        ),
+    )
 
     product_id: Mapped[int] = mapped_column(primary_key=True)
     uk_price: Mapped[float]
@@ -32,15 +40,22 @@ class Product(Base):
     long_description: Mapped[str] = mapped_column(nullable=True)
     net_weight: Mapped[float] = mapped_column(nullable=True)
     title: Mapped[str]
+    content_hash: Mapped[Optional[str]] = mapped_column(nullable=True)
+    updated_at: Mapped[Optional[int]] = mapped_column(
+        nullable=True, index=True
+    )
+    # Set when the product has dropped out of the feed; see
+    # `DatabaseFacade.retire_missing_products`.
+    retired_at: Mapped[Optional[int]] = mapped_column(nullable=True)
 
     brand_id: Mapped[int] = mapped_column(
-        ForeignKey("brands.brand_id"), nullable=True
+        ForeignKey("brands.brand_id"), nullable=True, index=True
     )
     category_id: Mapped[int] = mapped_column(
-        ForeignKey("categories.category_id"), nullable=True
+        ForeignKey("categories.category_id"), nullable=True, index=True
     )
     default_image_id: Mapped[Optional[int]] = mapped_column(
-        ForeignKey("images.image_id"), nullable=True
+        ForeignKey("images.image_id"), nullable=True, index=True
     )
 
     images = relationship("ProductImage", back_populates="product")
@@ -48,20 +63,6 @@ class Product(Base):
     brand = relationship("Brand")
     category = relationship("Category")
 
-    @validates("default_image_id")
-    def validate_default_image(self, key, image_id):
-        if image_id is None:
-            return None
-
-        image_ids = {pi.image_id for pi in self.images}
-
-        if image_id not in image_ids:
-            raise ValueError(
-                f"Image {image_id} is not linked to product {self.product_id}"
-            )
-
-        return image_id
-
 
 class Brand(Base):
     __tablename__ = "brands"
@@ -81,11 +82,29 @@ class Image(Base):
     modification_date: Mapped[int] = mapped_column(nullable=True)
 
 
+class ImageAsset(Base):
+    """
+    The local copy of an image, stored under its content hash. The image's
+    `modification_date` is recorded as fetched, so the asset is stale once
+    the feed reports a different one.
+    """
+
+    __tablename__ = "image_assets"
+
+    image_id: Mapped[int] = mapped_column(
+        ForeignKey("images.image_id"), primary_key=True
+    )
+    content_hash: Mapped[str] = mapped_column(index=True)
+    size: Mapped[int]
+    modification_date: Mapped[Optional[int]] = mapped_column(nullable=True)
+    fetched_at: Mapped[int]
+
+
 class Category(Base):
     __tablename__ = "categories"
 
     category_id: Mapped[int] = mapped_column(primary_key=True)
-    name: Mapped[str] = mapped_column(nullable=False)
+    name: Mapped[str] = mapped_column(nullable=False, index=True)
 
 
 class ProductImage(Base):
@@ -95,7 +114,7 @@ class ProductImage(Base):
         ForeignKey("products.product_id"), primary_key=True
     )
     image_id: Mapped[int] = mapped_column(
-        ForeignKey("images.image_id"), primary_key=True
+        ForeignKey("images.image_id"), primary_key=True, index=True
     )
 
     product = relationship("Product", back_populates="images")
@@ -109,7 +128,7 @@ class ChildProduct(Base):
         ForeignKey("products.product_id"), primary_key=True
     )
     child_product_id: Mapped[int] = mapped_column(
-        ForeignKey("products.product_id"), primary_key=True
+        ForeignKey("products.product_id"), primary_key=True, index=True
     )
 
     parent = relationship("Product", foreign_keys=[parent_product_id])
@@ -123,8 +142,196 @@ class ChildCategory(Base):
         ForeignKey("categories.category_id"), primary_key=True
     )
     child_category_id: Mapped[int] = mapped_column(
-        ForeignKey("categories.category_id"), primary_key=True
+        ForeignKey("categories.category_id"), primary_key=True, index=True
     )
 
     parent = relationship("Category", foreign_keys=[parent_category_id])
     child = relationship("Category", foreign_keys=[child_category_id])
+
+
+class CategoryClosure(Base):
+    """
+    Every (ancestor, descendant) pair of the category tree, including each
+    category paired with itself at depth 0, derived from `ChildCategory`.
+    """
+
+    __tablename__ = "category_closure"
+
+    ancestor_id: Mapped[int] = mapped_column(
+        ForeignKey("categories.category_id"), primary_key=True
+    )
+    descendant_id: Mapped[int] = mapped_column(
+        ForeignKey("categories.category_id"), primary_key=True, index=True
+    )
+    depth: Mapped[int]
+
+
+class PriceStockHistory(Base):
+    """
+    The price and stock of a product from `recorded_at` until its next row.
+    A row is only written when either value changes, by the triggers in
+    `TRIGGERS`. The table is clustered on its primary key, so the history
+    of a product is one contiguous range.
+    """
+
+    __tablename__ = "price_stock_history"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    product_id: Mapped[int] = mapped_column(
+        ForeignKey("products.product_id"), primary_key=True
+    )
+    recorded_at: Mapped[int] = mapped_column(primary_key=True, index=True)
+    uk_price: Mapped[float]
+    uk_stock: Mapped[int]
+
+
+class IngestRun(Base):
+    __tablename__ = "ingest_runs"
+
+    run_id: Mapped[int] = mapped_column(primary_key=True)
+    mode: Mapped[str] = mapped_column(index=True)
+    status: Mapped[str]
+    started_at: Mapped[int]
+    finished_at: Mapped[Optional[int]] = mapped_column(nullable=True)
+    total_count: Mapped[Optional[int]] = mapped_column(nullable=True)
+    committed_offset: Mapped[int] = mapped_column(default=0)
+    committed_pages: Mapped[int] = mapped_column(default=0)
+
+
+class PendingChildLink(Base):
+    """
+    The child SKUs of a parent SKU seen by an ingest run, as a JSON list,
+    kept until the run links its child products. Each batch writes its
+    rows in its own transaction, so a resumed run still links the parents
+    of the batches committed before it stopped.
+    """
+
+    __tablename__ = "pending_child_links"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    run_id: Mapped[int] = mapped_column(
+        ForeignKey("ingest_runs.run_id"), primary_key=True
+    )
+    parent_sku: Mapped[str] = mapped_column(primary_key=True)
+    child_skus: Mapped[str]
+
+
+# A product's default image must be one of its linked images. This is
+# enforced by the database so that bulk writers can bypass the ORM; write the
+# `ProductImage` link before setting `default_image_id`.
+TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_product_default_image_insert
+    AFTER INSERT ON products
+    WHEN NEW.default_image_id IS NOT NULL
+    BEGIN
+        SELECT RAISE(ABORT, 'default_image_id must reference an image linked to this product')
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM product_images
+            WHERE product_id = NEW.product_id
+              AND image_id = NEW.default_image_id
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_product_default_image_update
+    AFTER UPDATE OF default_image_id ON products
+    WHEN NEW.default_image_id IS NOT NULL
+    BEGIN
+        SELECT RAISE(ABORT, 'default_image_id must reference an image linked to this product')
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM product_images
+            WHERE product_id = NEW.product_id
+              AND image_id = NEW.default_image_id
+        );
+    END
+    """,
+]
+
+# Every write path, bulk or per product, records price and stock changes in
+# `price_stock_history` through these triggers, as part of the statement that
+# writes the batch. A product's current row holds the last values recorded,
+# so comparing against it writes a row only when a value actually changed.
+# Changes within the same second replace each other.
+_RECORD_PRICE_STOCK = """
+        INSERT OR REPLACE INTO price_stock_history
+            (product_id, recorded_at, uk_price, uk_stock)
+        VALUES (
+            new.product_id,
+            CAST(strftime('%s', 'now') AS INTEGER),
+            new.uk_price,
+            new.uk_stock
+        );
+"""
+
+TRIGGERS += [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_products_history_insert
+    AFTER INSERT ON products
+    BEGIN{_RECORD_PRICE_STOCK}    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_products_history_update
+    AFTER UPDATE OF uk_price, uk_stock ON products
+    WHEN old.uk_price IS NOT new.uk_price OR old.uk_stock IS NOT new.uk_stock
+    BEGIN{_RECORD_PRICE_STOCK}    END
+    """,
+]
+
+# Starts the history of a database whose products predate the table.
+PRICE_STOCK_HISTORY_SEED = """
+INSERT INTO price_stock_history (product_id, recorded_at, uk_price, uk_stock)
+SELECT product_id, CAST(strftime('%s', 'now') AS INTEGER), uk_price, uk_stock
+FROM products
+WHERE NOT EXISTS (SELECT 1 FROM price_stock_history)
+"""
+
+
+# Full-text index over the searchable product columns. It is an external
+# content table, so it stores only the index and reads the text back from
+# `products`; the triggers keep it in step with every write. A bulk load may
+# drop the triggers and rebuild the index once at the end instead.
+SEARCH_COLUMNS = ["sku", "ean", "title", "description", "long_description"]
+
+SEARCH_TABLE = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    {", ".join(SEARCH_COLUMNS)},
+    content='products',
+    content_rowid='product_id',
+    prefix='2 3'
+)
+"""
+
+_NEW_VALUES = ", ".join(f"new.{column}" for column in SEARCH_COLUMNS)
+_OLD_VALUES = ", ".join(f"old.{column}" for column in SEARCH_COLUMNS)
+
+SEARCH_TRIGGERS = {
+    "trg_products_fts_insert": f"""
+    CREATE TRIGGER IF NOT EXISTS trg_products_fts_insert
+    AFTER INSERT ON products
+    BEGIN
+        INSERT INTO products_fts (rowid, {", ".join(SEARCH_COLUMNS)})
+        VALUES (new.product_id, {_NEW_VALUES});
+    END
+    """,
+    "trg_products_fts_delete": f"""
+    CREATE TRIGGER IF NOT EXISTS trg_products_fts_delete
+    AFTER DELETE ON products
+    BEGIN
+        INSERT INTO products_fts (products_fts, rowid, {", ".join(SEARCH_COLUMNS)})
+        VALUES ('delete', old.product_id, {_OLD_VALUES});
+    END
+    """,
+    "trg_products_fts_update": f"""
+    CREATE TRIGGER IF NOT EXISTS trg_products_fts_update
+    AFTER UPDATE OF {", ".join(SEARCH_COLUMNS)} ON products
+    BEGIN
+        INSERT INTO products_fts (products_fts, rowid, {", ".join(SEARCH_COLUMNS)})
+        VALUES ('delete', old.product_id, {_OLD_VALUES});
+        INSERT INTO products_fts (rowid, {", ".join(SEARCH_COLUMNS)})
+        VALUES (new.product_id, {_NEW_VALUES});
+    END
+    """,
+}
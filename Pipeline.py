@@ -0,0 +1,180 @@
+from queue import Queue, Empty, Full
+from threading import Event, Thread
+import time
+
+
+_DONE = object()
+
+
+class StageStats:
+    """Timing and queue depth counters for a single pipeline stage."""
+
+    def __init__(self, name: str):
+        """Set up empty counters for the named stage."""
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.starved_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.max_queue_depth = 0
+        self._depth_total = 0
+        self._depth_samples = 0
+
+    def sample_queue(self, depth: int) -> None:
+        """Record the depth of the stage's input queue."""
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+        self._depth_total += depth
+        self._depth_samples += 1
+
+    @property
+    def mean_queue_depth(self) -> float:
+        if not self._depth_samples:
+            return 0.0
+        return self._depth_total / self._depth_samples
+
+    def as_dict(self) -> dict:
+        """Return the counters as a plain dict."""
+        return {
+            "stage": self.name,
+            "items": self.items,
+            "busy_seconds": self.busy_seconds,
+            "starved_seconds": self.starved_seconds,
+            "blocked_seconds": self.blocked_seconds,
+            "max_queue_depth": self.max_queue_depth,
+            "mean_queue_depth": self.mean_queue_depth,
+        }
+
+
+class Pipeline:
+    """
+    Run fetch, transform and write stages concurrently, connected by bounded
+    queues. Fetching and transforming run on worker threads while writing
+    stays on the calling thread, so all database work happens on one
+    connection. A full queue blocks the stage feeding it, which keeps memory
+    flat when a later stage is the limiter.
+    """
+
+    def __init__(self, source, transform, sink, queue_size: int = 4):
+        """
+        Set up a pipeline reading items from the `source` iterable, mapping
+        them with `transform` and passing the results to `sink`.
+        """
+        self._source = source
+        self._transform = transform
+        self._sink = sink
+        self._fetched = Queue(maxsize=queue_size)
+        self._transformed = Queue(maxsize=queue_size)
+        self._stop = Event()
+        self._error = None
+        self.stats = [
+            StageStats("fetch"),
+            StageStats("transform"),
+            StageStats("write"),
+        ]
+
+    def _put(self, queue: Queue, item, stats: StageStats) -> bool:
+        """
+        Put an item on a queue, waiting while it is full. Return `False` if
+        the pipeline was stopped in the meantime.
+        """
+        started = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    continue
+            return False
+        finally:
+            stats.blocked_seconds += time.perf_counter() - started
+
+    def _get(self, queue: Queue, stats: StageStats):
+        """Take the next item from a queue, waiting while it is empty."""
+        stats.sample_queue(queue.qsize())
+        started = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                try:
+                    return queue.get(timeout=0.1)
+                except Empty:
+                    continue
+            return _DONE
+        finally:
+            stats.starved_seconds += time.perf_counter() - started
+
+    def _fail(self, exc: BaseException) -> None:
+        """Record the first error raised by a stage and stop the others."""
+        if self._error is None:
+            self._error = exc
+        self._stop.set()
+
+    def _fetch(self) -> None:
+        stats = self.stats[0]
+        items = iter(self._source)
+        try:
+            while True:
+                started = time.perf_counter()
+                item = next(items, _DONE)
+                stats.busy_seconds += time.perf_counter() - started
+                if item is _DONE:
+                    break
+                stats.items += 1
+                if not self._put(self._fetched, item, stats):
+                    return
+        except BaseException as exc:
+            self._fail(exc)
+        finally:
+            close = getattr(items, "close", None)
+            if close:
+                close()
+        self._put(self._fetched, _DONE, stats)
+
+    def _run_transform(self) -> None:
+        stats = self.stats[1]
+        try:
+            while True:
+                item = self._get(self._fetched, stats)
+                if item is _DONE:
+                    break
+                started = time.perf_counter()
+                result = self._transform(item)
+                stats.busy_seconds += time.perf_counter() - started
+                stats.items += 1
+                if not self._put(self._transformed, result, stats):
+                    return
+        except BaseException as exc:
+            self._fail(exc)
+        self._put(self._transformed, _DONE, stats)
+
+    def run(self) -> list[StageStats]:
+        """Run the pipeline to completion and return the stage stats."""
+        stats = self.stats[2]
+        workers = [
+            Thread(target=self._fetch, name="pipeline-fetch", daemon=True),
+            Thread(
+                target=self._run_transform,
+                name="pipeline-transform",
+                daemon=True,
+            ),
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            while True:
+                item = self._get(self._transformed, stats)
+                if item is _DONE:
+                    break
+                started = time.perf_counter()
+                self._sink(item)
+                stats.busy_seconds += time.perf_counter() - started
+                stats.items += 1
+        except BaseException as exc:
+            self._fail(exc)
+        finally:
+            self._stop.set()
+            for worker in workers:
+                worker.join()
+        if self._error is not None:
+            raise self._error
+        return self.stats
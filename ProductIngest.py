@@ -1,7 +1,39 @@
-from sqlalchemy.orm import Session, sessionmaker
-from sqlalchemy import select
-from Engine import engine, create_tables
+from sqlalchemy.orm import Session, aliased, sessionmaker
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy import (
+    select,
+    insert,
+    update,
+    delete,
+    func,
+    distinct,
+    bindparam,
+    literal,
+    or_,
+    text,
+    tuple_,
+    Column,
+    MetaData,
+    String,
+    Table,
+)
+from Engine import (
+    PROFILES,
+    engine,
+    database_name,
+    create_profile_engine,
+    create_tables,
+    create_indexes,
+)
+from ListingStream import ListingDecoder
+from LookupCache import LookupCache
+from Metrics import Metrics, SamplingProfiler
+from Pipeline import Pipeline, StageStats
+from RateLimiter import RateLimiter
+from ResponseCache import ResponseCache
 from Models import (
+    IngestRun,
+    PendingChildLink,
     Product,
     Brand,
     Image,
@@ -9,298 +41,2239 @@ from Models import (
     ProductImage,
     ChildCategory,
     ChildProduct,
+    CategoryClosure,
+    PriceStockHistory,
+    SEARCH_COLUMNS,
 )
 
-from gql import Client, gql
+from gql import Client, GraphQLRequest, gql
 from gql.transport.aiohttp import AIOHTTPTransport
 from gql.transport.exceptions import TransportServerError
+from aiohttp.compression_utils import HAS_BROTLI
 from dotenv import load_dotenv
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime
+from itertools import count, islice
+from operator import itemgetter
 from os import getenv
+from typing import NamedTuple
+import aiohttp
+import argparse
+import asyncio
+import hashlib
+import json
 import time
 
 load_dotenv()
 
 
+PRODUCT_LISTING_QUERY = """
+query ($first: Int!, $after: Int) {
+    getProductListing(defaultLanguage: "en", first: $first, after: $after) {
+        totalCount
+        edges {
+            node {
+                sku
+                description
+                brand
+                category {
+                    ... on object_Category {
+                        name
+                        parent {
+                            ... on object_Category {
+                                name
+                            }
+                        }
+                        children {
+                            ... on object_Category {
+                                name
+                            }
+                        }
+                    }
+                }
+                depth
+                ean
+                dimensions
+                height
+                grossWeight
+                extraImages {
+                    image {
+                        creationDate
+                        filename
+                        fullpath
+                        mimetype
+                        modificationDate
+                    }
+                }
+                length
+                longDescription
+                netWeight
+                title
+                ukPrice
+                ukStock
+                width
+                children {
+                    ... on object_Product {
+                        sku
+                    }
+                }
+                defaultImage {
+                    creationDate
+                    filename
+                    fullpath
+                    mimetype
+                    modificationDate
+                }
+                creationDate
+            }
+        }
+    }
+}
+"""
+
+# Minimal selection for frequent price and stock refreshes.
+PRICE_STOCK_QUERY = """
+query ($first: Int!, $after: Int) {
+    getProductListing(defaultLanguage: "en", first: $first, after: $after) {
+        totalCount
+        edges {
+            node {
+                sku
+                ukPrice
+                ukStock
+            }
+        }
+    }
+}
+"""
+
+
+# Rough ratio of the memory taken by a decoded node (nested dicts, lists and
+# strings) to the size of its JSON text, used to apply a memory budget.
+NODE_MEMORY_FACTOR = 8
+
+# Bytes read from a streamed response at a time, and the number of nodes
+# handed on at a time when no memory budget is set.
+STREAM_READ_SIZE = 64 * 1024
+STREAM_CHUNK_NODES = 100
+
+# Idle API connections are kept open this long for the next request.
+KEEPALIVE_SECONDS = 60
+# Encodings the API may compress responses with; aiohttp can only decode br
+# when a Brotli package is installed.
+ACCEPT_ENCODING = "gzip, deflate, br" if HAS_BROTLI else "gzip, deflate"
+
+
 class ApiQueryManager:
     """Manage a set of queries to the API"""
 
-    def __init__(self):
-        """Initialise the GraphQl query, pagination and other variables"""
+    def __init__(
+        self,
+        concurrency: int = 1,
+        query: str = PRODUCT_LISTING_QUERY,
+        page_size: int = 100,
+        rate_limiter: RateLimiter | None = None,
+        adaptive_page_size: bool = True,
+        start_offset: int = 0,
+        metrics: Metrics | None = None,
+        response_cache: ResponseCache | None = None,
+        replay: bool = False,
+        stream: bool = False,
+        memory_budget: int | None = None,
+    ):
+        """
+        Initialise the GraphQl query, pagination and other variables. With a
+        `concurrency` above 1 pages are fetched asynchronously, that many at
+        a time. Every request waits on the `rate_limiter`, and with an
+        `adaptive_page_size` the page size shrinks when the API throttles or
+        slows down and grows again while it responds quickly. Fetching
+        starts from `start_offset`, so that an interrupted run can resume.
+        Page, request and rate limiter wait times are recorded in `metrics`.
+        Every raw page fetched is stored in the `response_cache`, or with
+        `replay` the pages are read back from it instead of the API.
+
+        With `stream` pages are fetched one at a time and their edges are
+        decoded as they arrive, so nodes are handed on in small lists instead
+        of whole pages. A `memory_budget` in bytes bounds the decoded nodes
+        held at once: the page size, or the size of each streamed list.
+        """
+        if stream and response_cache is not None and not replay:
+            raise ValueError("Responses cannot be recorded while streaming.")
         self._transport = AIOHTTPTransport(url=getenv("API_URL"))
         self._transport.headers = {
             "content-type": "application/json",
+            "Accept-Encoding": ACCEPT_ENCODING,
             "X-API-Key": getenv("API_KEY"),
         }
         # Create a GraphQL client using the defined transport
         self._client = Client(transport=self._transport)
-        self._page_size = 100
+        self._page_size = page_size
         self._has_more = True
-        self._offset = 0
+        self._offset = start_offset
         self._total_count = None
-        self._backoff_initial = 1.0  # seconds
         self._max_retries = 5
-        self._query = gql(
-            """
-            query ($first: Int!, $after: Int) {
-                getProductListing(defaultLanguage: "en", first: $first, after: $after) {
-                    totalCount
-                    edges {
-                        node {
-                            sku
-                            description
-                            brand
-                            category {
-                                ... on object_Category {
-                                    name
-                                    parent {
-                                        ... on object_Category {
-                                            name
-                                        }
-                                    }
-                                    children {
-                                        ... on object_Category {
-                                            name
-                                        }
-                                    }
-                                }
-                            }
-                            depth
-                            ean
-                            dimensions
-                            height
-                            grossWeight
-                            extraImages {
-                                image {
-                                    creationDate
-                                    filename
-                                    fullpath
-                                    mimetype
-                                    modificationDate
-                                }
-                            }
-                            length
-                            longDescription
-                            netWeight
-                            title
-                            ukPrice
-                            ukStock
-                            width
-                            children {
-                                ... on object_Product {
-                                    sku
-                                }
-                            }
-                            defaultImage {
-                                creationDate
-                                filename
-                                fullpath
-                                mimetype
-                                modificationDate
-                            }
-                            creationDate
-                        }
-                    }
-                }
-            }
-            """
+        self._rate_limiter = rate_limiter or RateLimiter()
+        self._metrics = metrics or Metrics()
+        self._response_cache = response_cache
+        self._replay = replay
+        self._query_key = ResponseCache.query_key(query)
+        self._adaptive_page_size = adaptive_page_size
+        self._min_page_size = max(1, page_size // 4)
+        self._max_page_size = page_size * 4
+        self._concurrency = max(1, concurrency)
+        self._stream = stream
+        self._memory_budget = memory_budget
+        self._node_bytes = None
+        self._query_text = query
+        self._query = gql(query)
+
+    def _page_request(self, offset: int, size: int) -> GraphQLRequest:
+        """Build the request for the page of `size` starting at `offset`."""
+        return GraphQLRequest(
+            self._query,
+            variable_values={"first": size, "after": offset},
+        )
+
+    @staticmethod
+    def _is_rate_limited(exc: TransportServerError) -> bool:
+        """Check whether a transport error is an HTTP 429 response."""
+        status = (
+            getattr(exc, "code", None)
+            or getattr(exc, "status_code", None)
+            or getattr(exc, "http_status", None)
+        )
+        return status == 429 or "429" in str(exc)
+
+    def _retry_after(self, exc: TransportServerError) -> float | None:
+        """Read the `Retry-After` delay of a throttled response, if given."""
+        headers = getattr(exc.__cause__, "headers", None)
+        if headers is None:
+            headers = getattr(self._transport, "response_headers", None)
+        return RateLimiter.retry_after(headers)
+
+    def _on_success(self, latency: float) -> None:
+        """Feed a successful request into the rate limiter and page size."""
+        self._rate_limiter.on_success(latency)
+        if (
+            self._adaptive_page_size
+            and latency < self._rate_limiter.target_latency / 2
+        ):
+            self._page_size = min(
+                self._max_page_size, self._page_size + self._page_size // 4
+            )
+        elif (
+            self._adaptive_page_size
+            and latency > self._rate_limiter.target_latency
+        ):
+            self._page_size = max(
+                self._min_page_size, self._page_size - self._page_size // 4
+            )
+
+    def _on_throttle(self, retry_after: float | None) -> None:
+        """Feed a throttled request into the rate limiter and page size."""
+        self._metrics.increment("api.throttled")
+        self._rate_limiter.on_throttle(retry_after)
+        if self._adaptive_page_size:
+            self._page_size = max(self._min_page_size, self._page_size // 2)
+        self._apply_memory_budget()
+
+    def _read_page(self, offset: int, response: dict) -> list:
+        """
+        Update the pagination state from the page fetched at the given offset
+        and return its edges.
+        """
+        data = response["getProductListing"]
+        edges = data.get("edges", [])
+        if self._total_count is None:
+            self._total_count = data.get("totalCount", 0)
+        self._offset = offset + len(edges)
+        self._has_more = len(edges) > 0 and self._offset < self._total_count
+        self._metrics.increment("api.nodes", len(edges))
+        if self._memory_budget and edges:
+            text = json.dumps(edges, separators=(",", ":"))
+            self._observe_node_bytes(len(text), len(edges))
+        if self._response_cache is not None and not self._replay:
+            self._response_cache.put(self._query_key, offset, response)
+        return edges
+
+    def _observe_node_bytes(self, size: int, nodes: int) -> None:
+        """
+        Update the running estimate of JSON bytes per node and keep the page
+        size within the memory budget.
+        """
+        node_bytes = size / nodes
+        if self._node_bytes is None:
+            self._node_bytes = node_bytes
+        else:
+            self._node_bytes = 0.8 * self._node_bytes + 0.2 * node_bytes
+        self._apply_memory_budget()
+
+    def _apply_memory_budget(self) -> None:
+        """Shrink the page size to the memory budget unless streaming."""
+        if not self._stream:
+            self._page_size = min(self._page_size, self._budget_nodes())
+
+    def _budget_nodes(self) -> int:
+        """Return how many decoded nodes fit in the memory budget."""
+        if not (self._memory_budget and self._node_bytes):
+            return self._max_page_size
+        node_memory = self._node_bytes * NODE_MEMORY_FACTOR
+        return max(1, int(self._memory_budget // node_memory))
+
+    def _stream_chunk_size(self) -> int:
+        """Return how many streamed nodes to hand on at a time."""
+        if self._memory_budget and self._node_bytes:
+            return min(self._page_size, self._budget_nodes())
+        return min(self._page_size, STREAM_CHUNK_NODES)
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        """
+        Time the phases of every API request into the metrics: `api.connect`
+        for opening a new connection (DNS, TCP and TLS), `api.wait` from
+        sending the request to receiving its headers and `api.transfer` for
+        reading its body. New and reused connections are counted, as are
+        the body bytes after decompression. Bytes on the wire are only known
+        from a `Content-Length`, so `api.content_length_bytes` covers only
+        the responses that send one and the others are counted in
+        `api.responses_without_length`.
+        """
+        metrics = self._metrics
+        trace = aiohttp.TraceConfig()
+
+        async def request_start(session, context, params):
+            context.started = time.perf_counter()
+            context.connect = 0.0
+
+        async def connection_create_start(session, context, params):
+            context.connecting = time.perf_counter()
+
+        async def connection_create_end(session, context, params):
+            context.connect = time.perf_counter() - context.connecting
+            metrics.observe("api.connect", context.connect)
+            metrics.increment("api.connections_opened")
+
+        async def connection_reuse(session, context, params):
+            metrics.increment("api.connections_reused")
+
+        async def request_end(session, context, params):
+            context.headers = time.perf_counter()
+            metrics.observe(
+                "api.wait", context.headers - context.started - context.connect
+            )
+            if params.response.content_length is None:
+                metrics.increment("api.responses_without_length")
+            else:
+                metrics.increment(
+                    "api.content_length_bytes", params.response.content_length
+                )
+
+        async def response_chunk_received(session, context, params):
+            # A response read whole reports its body as a single chunk.
+            metrics.observe(
+                "api.transfer", time.perf_counter() - context.headers
+            )
+            metrics.increment("api.decoded_bytes", len(params.chunk))
+
+        trace.on_request_start.append(request_start)
+        trace.on_connection_create_start.append(connection_create_start)
+        trace.on_connection_create_end.append(connection_create_end)
+        trace.on_connection_reuseconn.append(connection_reuse)
+        trace.on_request_end.append(request_end)
+        trace.on_response_chunk_received.append(response_chunk_received)
+        return trace
+
+    def _session_args(self) -> dict:
+        """
+        Return the arguments of the client session that every API request of
+        a run goes through: a pool of keep-alive connections, one per page in
+        flight, and request tracing. Must be called on the session's loop.
+        """
+        return {
+            "connector": aiohttp.TCPConnector(
+                limit=self._concurrency,
+                keepalive_timeout=KEEPALIVE_SECONDS,
+                ttl_dns_cache=None,
+            ),
+            "trace_configs": [self._trace_config()],
+        }
+
+    async def _connect(self):
+        """Connect the GraphQL client and return its session."""
+        self._transport.client_session_args = self._session_args()
+        return await self._client.connect_async()
+
+    async def _open_stream_session(self) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(
+            headers=self._transport.headers, **self._session_args()
         )
-        self._current_products = iter([])
 
-    def _query_page(self):
+    def _stream_page(self, loop, session: aiohttp.ClientSession):
+        """
+        Fetch the next page and yield its nodes in lists of up to the memory
+        budget (or the page size) as they are decoded from the response.
+        """
+        page_started = time.perf_counter()
+        suspended = 0.0
+        retries = 0
+        payload = {
+            "query": self._query_text,
+            "variables": {"first": self._page_size, "after": self._offset},
+        }
+        while True:
+            with self._metrics.timer("api.rate_limit_wait"):
+                self._rate_limiter.acquire()
+            started = time.perf_counter()
+            response = loop.run_until_complete(
+                session.post(self._transport.url, json=payload)
+            )
+            if response.status == 429 and retries < self._max_retries:
+                response.release()
+                self._metrics.observe(
+                    "api.request", time.perf_counter() - started
+                )
+                self._on_throttle(RateLimiter.retry_after(response.headers))
+                retries += 1
+                continue
+            break
+        decoder = ListingDecoder()
+        transfer_started = time.perf_counter()
+        try:
+            if response.status >= 400:
+                raise TransportServerError(
+                    f"{response.status}, message='{response.reason}'",
+                    response.status,
+                )
+            nodes = []
+            while True:
+                data = loop.run_until_complete(
+                    response.content.read(STREAM_READ_SIZE)
+                )
+                if not data:
+                    break
+                # Streamed reads bypass the trace's chunk hook.
+                self._metrics.increment("api.decoded_bytes", len(data))
+                for node in decoder.feed(data):
+                    nodes.append(node)
+                    if len(nodes) >= self._stream_chunk_size():
+                        self._offset += len(nodes)
+                        yielded = time.perf_counter()
+                        yield nodes
+                        suspended += time.perf_counter() - yielded
+                        nodes = []
+            decoder.close()
+        finally:
+            response.release()
+        self._metrics.observe(
+            "api.transfer", time.perf_counter() - transfer_started - suspended
+        )
+        latency = time.perf_counter() - started - suspended
+        self._metrics.observe("api.request", latency)
+        self._on_success(latency)
+        self._metrics.increment("api.nodes", decoder.nodes)
+        self._offset += len(nodes)
+        if self._total_count is None:
+            self._total_count = decoder.total_count or 0
+        self._has_more = decoder.nodes > 0 and self._offset < self._total_count
+        if decoder.nodes:
+            self._observe_node_bytes(decoder.bytes, decoder.nodes)
+        self._metrics.observe(
+            "api.page", time.perf_counter() - page_started - suspended
+        )
+        if nodes:
+            yield nodes
+
+    def _get_pages_streaming(self):
+        """Yield the nodes of each page in order, streaming every response."""
+        loop = asyncio.new_event_loop()
+        session = loop.run_until_complete(self._open_stream_session())
+        try:
+            while self._has_more:
+                yield from self._stream_page(loop, session)
+        finally:
+            loop.run_until_complete(session.close())
+            loop.close()
+
+    def _replay_pages(self):
         """
-        Query for the next page of results from the API.
+        Yield each page recorded in the response cache from the current
+        offset on, as the API returned it.
         """
+        while self._has_more:
+            found = self._response_cache.find(self._query_key, self._offset)
+            if found is None:
+                raise LookupError(
+                    f"No page of this query recorded at offset {self._offset}."
+                )
+            page_offset, response = found
+            skip = self._offset - page_offset
+            edges = self._read_page(page_offset, response)
+            nodes = [edge["node"] for edge in edges[skip:]]
+            if nodes:
+                yield nodes
+
+    async def _query_page_async(self, session, offset: int, size: int) -> dict:
+        """
+        Query for the page of results of `size` starting at `offset` on an
+        open async session. Retries keep the same size so that pages already
+        scheduled after this one still line up.
+        """
+        page_started = time.perf_counter()
         retries = 0
-        delay = self._backoff_initial
         while True:
+            with self._metrics.timer("api.rate_limit_wait"):
+                await self._rate_limiter.acquire_async()
+            started = time.perf_counter()
             try:
-                response = self._client.execute(
-                    self._query,
-                    variable_values={
-                        "first": self._page_size,
-                        "after": self._offset,
-                    },
+                response = await session.execute(
+                    self._page_request(offset, size)
                 )
                 break
             except TransportServerError as exc:
-                status = (
-                    getattr(exc, "code", None)
-                    or getattr(exc, "status_code", None)
-                    or getattr(exc, "http_status", None)
-                )
-                if (
-                    status == 429 or "429" in str(exc)
-                ) and retries < self._max_retries:
-                    time.sleep(delay)
+                if self._is_rate_limited(exc) and retries < self._max_retries:
+                    self._on_throttle(self._retry_after(exc))
                     retries += 1
-                    delay *= 2
                     continue
                 raise
-        data = response["getProductListing"]
-        edges = data.get("edges", [])
-        if self._total_count is None:
-            self._total_count = data.get("totalCount", 0)
-        self._offset += len(edges)
-        self._has_more = len(edges) > 0 and self._offset < self._total_count
-        self._current_products = iter(edges)
+            finally:
+                self._metrics.observe(
+                    "api.request", time.perf_counter() - started
+                )
+        self._on_success(time.perf_counter() - started)
+        self._metrics.observe("api.page", time.perf_counter() - page_started)
+        return response
+
+    def _get_pages_sequentially(self):
+        """
+        Yield each page of products in order, one request at a time, over a
+        single connected session kept open for the whole run.
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            session = loop.run_until_complete(self._connect())
+            while self._has_more:
+                offset = self._offset
+                response = loop.run_until_complete(
+                    self._query_page_async(session, offset, self._page_size)
+                )
+                nodes = [
+                    edge["node"] for edge in self._read_page(offset, response)
+                ]
+                if nodes:
+                    yield nodes
+        finally:
+            loop.run_until_complete(self._client.close_async())
+            loop.close()
+
+    def _scheduled_pages(self):
+        """
+        Yield the offset and size of each remaining page, reading the current
+        page size as each one is scheduled.
+        """
+        offset = self._offset
+        while offset < self._total_count:
+            size = self._page_size
+            yield offset, size
+            offset += size
+
+    def _get_pages_concurrently(self):
+        """
+        Yield each page of products in order, fetching up to `_concurrency`
+        pages at once over a single connected session. The first page is
+        fetched alone to learn `totalCount`, from which the offsets of the
+        remaining pages are computed.
+        """
+        loop = asyncio.new_event_loop()
+        pending = deque()
+
+        def schedule(pages) -> None:
+            for offset, size in pages:
+                task = loop.create_task(
+                    self._query_page_async(session, offset, size)
+                )
+                pending.append((offset, size, task))
+
+        try:
+            session = loop.run_until_complete(self._connect())
+            offset = self._offset
+            response = loop.run_until_complete(
+                self._query_page_async(session, offset, self._page_size)
+            )
+            edges = self._read_page(offset, response)
+            if edges:
+                yield [edge["node"] for edge in edges]
+            pages = self._scheduled_pages()
+            schedule(islice(pages, self._concurrency))
+            while pending and self._has_more:
+                offset, size, task = pending.popleft()
+                response = loop.run_until_complete(task)
+                schedule(islice(pages, 1))
+                edges = self._read_page(offset, response)
+                # A page cut short by the API would leave a gap before the
+                # next scheduled offset, so fetch the rest of it first.
+                while 0 < len(edges) < size and self._has_more:
+                    self._max_page_size = min(self._max_page_size, len(edges))
+                    self._min_page_size = min(
+                        self._min_page_size, self._max_page_size
+                    )
+                    self._page_size = min(self._page_size, self._max_page_size)
+                    yield [edge["node"] for edge in edges]
+                    size -= len(edges)
+                    response = loop.run_until_complete(
+                        self._query_page_async(session, self._offset, size)
+                    )
+                    edges = self._read_page(self._offset, response)
+                if edges:
+                    yield [edge["node"] for edge in edges]
+        finally:
+            for _, _, task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(
+                    asyncio.gather(
+                        *(task for _, _, task in pending),
+                        return_exceptions=True,
+                    )
+                )
+            loop.run_until_complete(self._client.close_async())
+            loop.close()
+        self._has_more = False
+
+    @property
+    def offset(self) -> int:
+        return self._offset
+
+    @property
+    def total_count(self) -> int | None:
+        return self._total_count
+
+    def rate_limiter_stats(self) -> dict:
+        """Return the rate limiter counters and the current page size."""
+        return {**self._rate_limiter.stats(), "page_size": self._page_size}
 
     def get_products(self):
         """
         Yield the generator of products from the API
         """
-        while True:
-            try:
-                product = next(self._current_products)
-                yield product["node"]
-            except StopIteration:
-                if not self._has_more:
-                    break
-                self._query_page()
+        for nodes in self.get_pages():
+            yield from nodes
+
+    def get_pages(self):
+        """
+        Yield each page of products from the API as a list of nodes.
+        """
+        if self._replay:
+            yield from self._replay_pages()
+            return
+        if self._stream:
+            yield from self._get_pages_streaming()
+            return
+        if self._concurrency > 1:
+            yield from self._get_pages_concurrently()
+            return
+        yield from self._get_pages_sequentially()
+
+
+def _normalize_name(name: str) -> str:
+    """Normalise a brand or category name for storage and lookups."""
+    return name.strip()
+
+
+def content_hash(node: dict) -> str:
+    """Hash the content of an API product node to detect changes."""
+    encoded = json.dumps(node, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(encoded.encode(), digest_size=16).hexdigest()
+
+
+class ProductRow(NamedTuple):
+    """Column values of a `products` row as mapped from an API node."""
+
+    uk_price: float
+    uk_stock: int
+    width: int | None
+    creation_date: int
+    depth: int | None
+    description: str
+    dimensions: str | None
+    ean: str | None
+    sku: str
+    gross_weight: float | None
+    height: int | None
+    length: int | None
+    long_description: str | None
+    net_weight: float | None
+    title: str
+
+
+class BrandRow(NamedTuple):
+    """A `brands` row; the id is `None` until it has been inserted."""
+
+    brand_id: int | None
+    name: str
+
+
+class CategoryRow(NamedTuple):
+    """A `categories` row; the id is `None` until it has been inserted."""
+
+    category_id: int | None
+    name: str
+
+
+class ImageRow(NamedTuple):
+    """An `images` row; the id is `None` until it has been inserted."""
+
+    image_id: int | None
+    creation_date: int | None
+    filename: str
+    fullpath: str
+    mimetype: str | None
+    modification_date: int | None
+
+
+# Columns of a new `products` row: a `ProductRow` followed by its foreign
+# keys and sync state.
+PRODUCT_INSERT_FIELDS = ProductRow._fields + (
+    "brand_id",
+    "category_id",
+    "content_hash",
+    "updated_at",
+)
+
+
+def product_row(node: dict) -> ProductRow:
+    """Map an API product node onto a `products` row."""
+    return ProductRow(
+        node["ukPrice"],
+        node["ukStock"],
+        node["width"],
+        node["creationDate"],
+        node["depth"],
+        node["description"],
+        node["dimensions"],
+        node["ean"],
+        node["sku"].strip(),
+        node["grossWeight"],
+        node["height"],
+        node["length"],
+        node["longDescription"],
+        node["netWeight"],
+        node["title"],
+    )
+
+
+def product_values(node: dict) -> dict:
+    """Map an API product node onto `Product` column values."""
+    return product_row(node)._asdict()
+
+
+IMAGE_FIELDS = ImageRow._fields[1:]
+
+
+def image_row(image: dict) -> ImageRow:
+    """Map an API image (or extra image wrapper) onto an `images` row."""
+    if "image" in image:
+        image = image["image"]
+    return ImageRow(
+        None,
+        image["creationDate"],
+        image["filename"],
+        image["fullpath"].strip(),
+        image["mimetype"],
+        image["modificationDate"],
+    )
+
+
+def image_values(image: dict) -> dict:
+    """Map an API image (or extra image wrapper) onto `Image` column values."""
+    return dict(zip(IMAGE_FIELDS, image_row(image)[1:]))
+
+
+# Weight of each of `SEARCH_COLUMNS` in the search ranking: identifiers
+# first, then the title, then the descriptions.
+SEARCH_WEIGHTS = {
+    "sku": 10.0,
+    "ean": 10.0,
+    "title": 5.0,
+    "description": 2.0,
+    "long_description": 1.0,
+}
+
+
+def search_query(words: str) -> str:
+    """
+    Turn free text into an FTS5 query matching every word. Each word is
+    quoted so that punctuation in SKUs and user input is not read as query
+    syntax; a word ending in `*` matches as a prefix.
+    """
+    terms = []
+    for word in words.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return " ".join(terms)
+
+
+class PricePoint(NamedTuple):
+    """The price and stock of a product from `recorded_at` on."""
+
+    recorded_at: int
+    uk_price: float
+    uk_stock: int
+
+
+class PriceChange(NamedTuple):
+    """A change of a product's price recorded at `recorded_at`."""
+
+    sku: str
+    recorded_at: int
+    old_price: float
+    new_price: float
+
+
+def start_of_today() -> int:
+    """Return the Unix time of the last local midnight."""
+    return int(datetime.combine(date.today(), datetime.min.time()).timestamp())
+
+
+@dataclass
+class PreparedBatch:
+    """Rows extracted from a batch of API nodes, keyed for a single write."""
+
+    nodes: int = 0
+    products: dict = field(default_factory=dict)
+    hashes: dict = field(default_factory=dict)
+    brands: dict = field(default_factory=dict)
+    categories: dict = field(default_factory=dict)
+    parent_categories: dict = field(default_factory=dict)
+    child_categories: dict = field(default_factory=dict)
+    images: dict = field(default_factory=dict)
+    product_images: dict = field(default_factory=dict)
+    default_images: dict = field(default_factory=dict)
+    child_skus: dict = field(default_factory=dict)
+
+
+class DefaultImageError(ValueError):
+    """Raised when products have a default image they are not linked to."""
+
+    def __init__(self, skus: list[str]):
+        self.skus = skus
+        super().__init__(
+            "Default image is not linked to product(s): " + ", ".join(skus)
+        )
+
+
+@dataclass
+class BatchResult:
+    """Row counts and timing for a single batched write."""
+
+    nodes: int = 0
+    products: int = 0
+    updated: int = 0
+    skipped: int = 0
+    reinstated: int = 0
+    brands: int = 0
+    categories: int = 0
+    category_links: int = 0
+    images: int = 0
+    product_images: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows(self) -> int:
+        return (
+            self.products
+            + self.updated
+            + self.brands
+            + self.categories
+            + self.category_links
+            + self.images
+            + self.product_images
+        )
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def add(self, other: "BatchResult") -> None:
+        """Accumulate the counts and timing of another result."""
+        for name in self.__dataclass_fields__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+
+@dataclass
+class ChildLinkResult:
+    """Outcome of resolving the parent/child SKU pairs of a run."""
+
+    pairs: int = 0
+    linked: int = 0
+    removed: int = 0
+    unresolved: list = field(default_factory=list)
+
+
+@dataclass
+class RetireResult:
+    """Outcome of the sweep for products missing from a full run."""
+
+    seen: int = 0
+    retired: int = 0
+    product_images: int = 0
+    child_products: int = 0
+    seconds: float = 0.0
+
+
+# The SKUs seen in the feed during a run. SQLite keeps a temporary table per
+# connection, so it lives on a connection held for the run.
+SEEN_SKUS = Table(
+    "seen_skus",
+    MetaData(),
+    Column("sku", String, primary_key=True),
+    prefixes=["TEMPORARY"],
+    sqlite_with_rowid=False,
+)
 
 
 class DatabaseFacade:
     """Interact with the database entities."""
 
-    def __init__(self, engine):
-        """Set up instance properties."""
+    def __init__(
+        self,
+        engine,
+        cache_size: int | None = None,
+        metrics: Metrics | None = None,
+    ):
+        """
+        Set up instance properties. Each lookup cache holds at most
+        `cache_size` entries; `None` leaves them unbounded and `0` disables
+        caching. With `metrics` every statement run on the engine is counted
+        and timed.
+        """
         self._engine = engine
+        if metrics is not None:
+            metrics.instrument_engine(engine)
         # session factory with expire_on_commit disabled to avoid detaching objects
         self._Session = sessionmaker(bind=self._engine, expire_on_commit=False)
+        self._brands = LookupCache("brands", cache_size)
+        self._categories = LookupCache("categories", cache_size)
+        self._images = LookupCache("images", cache_size)
+        self._products = LookupCache("products", cache_size)
+        self._child_skus = {}
+        self._retired_skus = {}
+        self._seen_connection = None
+        self._driver_sql = {}
+
+    def warm_cache(self) -> None:
+        """
+        Preload the lookup caches from the brands, categories, images and
+        product SKUs already in the database. The caches assume this facade
+        is the only writer while it is in use.
+        """
+        with self._Session() as session:
+            for cache, record, table, key in (
+                (self._brands, BrandRow, Brand.__table__, "name"),
+                (self._categories, CategoryRow, Category.__table__, "name"),
+                (self._images, ImageRow, Image.__table__, "fullpath"),
+            ):
+                total = session.scalar(
+                    select(func.count(distinct(table.c[key])))
+                )
+                stmt = select(*(table.c[name] for name in record._fields))
+                rows = session.execute(
+                    stmt.order_by(
+                        table.c[record._fields[0]]
+                    ).execution_options(yield_per=1000)
+                )
+                cache.load(
+                    (
+                        (row[record._fields.index(key)], record(*row))
+                        for row in rows
+                    ),
+                    total,
+                )
+            total = session.scalar(select(func.count(Product.sku)))
+            stmt = select(Product.sku, Product.product_id)
+            rows = session.execute(stmt.execution_options(yield_per=1000))
+            self._products.load(((sku, pid) for sku, pid in rows), total)
+            stmt = select(Product.sku, Product.product_id).where(
+                Product.retired_at.is_not(None)
+            )
+            self._retired_skus = dict(session.execute(stmt).all())
+
+    def cache_stats(self) -> dict:
+        """Return the hit/miss counters of each lookup cache."""
+        return {
+            cache.name: cache.stats()
+            for cache in (
+                self._brands,
+                self._categories,
+                self._images,
+                self._products,
+            )
+        }
+
+    def _executemany(
+        self,
+        session: Session,
+        name: str,
+        build,
+        fields: list[str],
+        rows: list[tuple],
+    ) -> None:
+        """
+        Run the Core statement returned by `build` once for each positional
+        row of `fields` through the driver's executemany, skipping the
+        per-row parameter processing of `Session.execute`. Every parameter
+        of the statement must be a `bindparam` named after one of `fields`.
+        The statement is compiled once and kept under `name`.
+        """
+        if not rows:
+            return
+        compiled = self._driver_sql.get(name)
+        if compiled is None:
+            statement = build().compile(dialect=self._engine.dialect)
+            order = [fields.index(key) for key in statement.positiontup]
+            reorder = None
+            if order != list(range(len(fields))):
+                reorder = itemgetter(*order)
+            compiled = self._driver_sql[name] = (str(statement), reorder)
+        sql, reorder = compiled
+        if reorder:
+            rows = [reorder(row) for row in rows]
+        session.connection().exec_driver_sql(sql, rows)
+
+    def prepare_batch(self, nodes: list[dict]) -> PreparedBatch:
+        """
+        Extract the product, brand, category and image rows of the given API
+        nodes. Duplicate SKUs within the batch keep their first occurrence.
+        """
+        batch = PreparedBatch(nodes=len(nodes))
+        for node in nodes:
+            row = product_row(node)
+            sku = row.sku
+            if sku in batch.products:
+                continue
+            batch.products[sku] = row
+            batch.hashes[sku] = content_hash(node)
+            if node["brand"]:
+                batch.brands[sku] = _normalize_name(node["brand"])
+            for category in node["category"] or []:
+                category_name = _normalize_name(category["name"])
+                batch.categories[sku] = category_name
+                parent = category.get("parent")
+                batch.parent_categories[category_name] = (
+                    _normalize_name(parent["name"]) if parent else None
+                )
+                children = [
+                    _normalize_name(child["name"])
+                    for child in category.get("children") or []
+                ]
+                batch.child_categories[category_name] = children
+                for child_name in children:
+                    batch.parent_categories[child_name] = category_name
+            fullpaths = []
+            for image in node["extraImages"] or []:
+                image = image_row(image)
+                batch.images.setdefault(image.fullpath, image)
+                fullpaths.append(image.fullpath)
+            if node["defaultImage"]:
+                image = image_row(node["defaultImage"])
+                batch.images.setdefault(image.fullpath, image)
+                fullpaths.append(image.fullpath)
+                batch.default_images[sku] = image.fullpath
+            batch.product_images[sku] = list(dict.fromkeys(fullpaths))
+            batch.child_skus[sku] = list(
+                dict.fromkeys(
+                    child["sku"].strip() for child in node["children"] or []
+                )
+            )
+        return batch
+
+    def _ensure_rows(
+        self,
+        session: Session,
+        table,
+        key: str,
+        cache: LookupCache,
+        rows: dict,
+        pending: list,
+    ) -> tuple[dict, int]:
+        """
+        Return a map of key to row record for the given records of `table`,
+        whose ids are `None`, inserting any that are missing with a single
+        executemany insert and reading their ids back. Rows read or inserted
+        are appended to `pending` so they can be cached once the batch
+        commits.
+        """
+        records = {}
+        lookup = []
+        for name in rows:
+            hit, record = cache.lookup(name)
+            if record is not None:
+                records[name] = record
+            elif not hit:
+                lookup.append(name)
+        if not lookup and len(records) == len(rows):
+            return records, 0
+        record_type = type(next(iter(rows.values())))
+        columns = [table.c[name] for name in record_type._fields]
+        at = record_type._fields.index(key)
+
+        def read(names):
+            stmt = select(*columns).where(table.c[key].in_(names))
+            for row in session.execute(stmt):
+                if row[at] not in records:
+                    records[row[at]] = record = record_type(*row)
+                    pending.append((cache, row[at], record))
+
+        if lookup:
+            read(lookup)
+        missing = [name for name in rows if name not in records]
+        if missing:
+            fields = record_type._fields[1:]
+            self._executemany(
+                session,
+                f"insert {table.name}",
+                lambda: insert(table).values(
+                    {name: bindparam(name) for name in fields}
+                ),
+                list(fields),
+                [rows[name][1:] for name in missing],
+            )
+            # The driver's executemany cannot return the new ids.
+            read(missing)
+        return records, len(missing)
+
+    def write_batch(
+        self,
+        batch: PreparedBatch,
+        sync: bool = False,
+        run_id: int | None = None,
+        total_count: int | None = None,
+    ) -> BatchResult:
+        """
+        Write a prepared batch in a single transaction. Products whose SKU
+        already exists are skipped, as in the per-product ingest, unless
+        `sync` is set, in which case those whose content hash differs from
+        the stored one are updated along with their brand, category and
+        image links. Retired products are always rewritten, which reinstates
+        them. The batch's child SKUs are deferred for `link_child_products`.
+        With a `run_id` they are stored with the run, and the run's watermark
+        is advanced past the batch, in the same transaction.
+        """
+        started = time.perf_counter()
+        result = BatchResult(nodes=batch.nodes)
+        pending = []
+        with self._Session.begin() as session:
+            existing = {}
+            if sync:
+                stmt = select(
+                    Product.sku,
+                    Product.product_id,
+                    Product.content_hash,
+                    Product.retired_at,
+                ).where(Product.sku.in_(list(batch.products)))
+                for row in session.execute(stmt):
+                    sku, product_id = row.sku, row.product_id
+                    pending.append((self._products, sku, product_id))
+                    if row.retired_at is not None:
+                        self._retired_skus[sku] = product_id
+                    if row.content_hash != batch.hashes[sku]:
+                        existing[sku] = product_id
+                    else:
+                        existing[sku] = None
+            else:
+                # Retired products lost their image links, so one that is
+                # back is rewritten in full rather than skipped.
+                lookup = []
+                for sku in batch.products:
+                    hit, product_id = self._products.lookup(sku)
+                    if product_id is not None:
+                        existing[sku] = self._retired_skus.get(sku)
+                    elif not hit:
+                        lookup.append(sku)
+                if lookup:
+                    stmt = select(
+                        Product.sku, Product.product_id, Product.retired_at
+                    ).where(Product.sku.in_(lookup))
+                    for sku, product_id, retired_at in session.execute(stmt):
+                        if retired_at is None:
+                            existing[sku] = None
+                        else:
+                            existing[sku] = product_id
+                            self._retired_skus[sku] = product_id
+                        pending.append((self._products, sku, product_id))
+            new_skus = [sku for sku in batch.products if sku not in existing]
+            changed = {
+                sku: product_id
+                for sku, product_id in existing.items()
+                if product_id is not None
+            }
+            result.skipped = len(existing) - len(changed)
+            reinstated = [sku for sku in changed if sku in self._retired_skus]
+            result.reinstated = len(reinstated)
+            if new_skus:
+                self._write_new_products(
+                    session, batch, new_skus, result, pending
+                )
+            if changed:
+                self._update_products(session, batch, changed, result, pending)
+            if run_id is not None:
+                self._store_child_links(session, run_id, batch.child_skus)
+                session.execute(
+                    update(IngestRun)
+                    .where(IngestRun.run_id == run_id)
+                    .values(
+                        committed_offset=IngestRun.committed_offset
+                        + batch.nodes,
+                        committed_pages=IngestRun.committed_pages + 1,
+                        total_count=total_count,
+                    )
+                )
+        # Only cache rows once they are known to be committed.
+        for cache, key, value in pending:
+            cache.put(key, value)
+        if run_id is None:
+            self.defer_child_links(batch.child_skus)
+        for sku in reinstated:
+            del self._retired_skus[sku]
+        result.seconds = time.perf_counter() - started
+        return result
+
+    def _resolve_related(
+        self,
+        session: Session,
+        batch: PreparedBatch,
+        skus: list[str],
+        result: BatchResult,
+        pending: list,
+    ) -> tuple[dict, dict]:
+        """
+        Find or insert the brands, categories and images of the given SKUs.
+        Return a map of each SKU to its `(brand_id, category_id)` and a map
+        of image fullpath to id.
+        """
+        brands, result.brands = self._ensure_rows(
+            session,
+            Brand.__table__,
+            "name",
+            self._brands,
+            {
+                batch.brands[sku]: BrandRow(None, batch.brands[sku])
+                for sku in skus
+                if sku in batch.brands
+            },
+            pending,
+        )
+        category_names = {}
+        for sku in skus:
+            if sku in batch.categories:
+                name = batch.categories[sku]
+                related = [name, batch.parent_categories.get(name)]
+                related += batch.child_categories.get(name, [])
+                for related_name in filter(None, related):
+                    category_names[related_name] = CategoryRow(
+                        None, related_name
+                    )
+        categories, result.categories = self._ensure_rows(
+            session,
+            Category.__table__,
+            "name",
+            self._categories,
+            category_names,
+            pending,
+        )
+        parents = {}
+        for name, category in categories.items():
+            if name in batch.parent_categories:
+                parent = categories.get(batch.parent_categories[name])
+                parents[category.category_id] = (
+                    parent.category_id if parent else None
+                )
+        result.category_links += self._link_categories(session, parents)
+        images, result.images = self._ensure_rows(
+            session,
+            Image.__table__,
+            "fullpath",
+            self._images,
+            {
+                fullpath: batch.images[fullpath]
+                for sku in skus
+                for fullpath in batch.product_images[sku]
+            },
+            pending,
+        )
+        foreign_keys = {}
+        for sku in skus:
+            brand = brands.get(batch.brands.get(sku))
+            category = categories.get(batch.categories.get(sku))
+            foreign_keys[sku] = (
+                brand.brand_id if brand else None,
+                category.category_id if category else None,
+            )
+        image_ids = {key: image.image_id for key, image in images.items()}
+        return foreign_keys, image_ids
+
+    def _link_categories(self, session: Session, parents: dict) -> int:
+        """
+        Set the parent of each category id in `parents` (`None` for a top
+        level category), keeping `ChildCategory` and the `CategoryClosure`
+        rows of the moved subtrees in step. Return how many categories were
+        attached or moved; a parent that would create a cycle is ignored.
+        """
+        if not parents:
+            return 0
+        closure = CategoryClosure.__table__
+        category_ids = set(parents) | set(filter(None, parents.values()))
+        session.execute(
+            sqlite_insert(closure).on_conflict_do_nothing(),
+            [
+                {
+                    "ancestor_id": category_id,
+                    "descendant_id": category_id,
+                    "depth": 0,
+                }
+                for category_id in category_ids
+            ],
+        )
+        stmt = select(
+            ChildCategory.child_category_id, ChildCategory.parent_category_id
+        ).where(ChildCategory.child_category_id.in_(list(parents)))
+        current = dict(session.execute(stmt).all())
+        ancestor = aliased(closure)
+        descendant = aliased(closure)
+        linked = 0
+        for child_id, parent_id in parents.items():
+            if current.get(child_id) == parent_id:
+                continue
+            if parent_id is not None:
+                cycle = session.scalar(
+                    select(closure.c.depth).where(
+                        closure.c.ancestor_id == child_id,
+                        closure.c.descendant_id == parent_id,
+                    )
+                )
+                if cycle is not None:
+                    continue
+            if child_id in current:
+                # Detach the subtree from every ancestor above the child.
+                session.execute(
+                    delete(ChildCategory).where(
+                        ChildCategory.child_category_id == child_id
+                    )
+                )
+                session.execute(
+                    delete(closure).where(
+                        closure.c.descendant_id.in_(
+                            select(closure.c.descendant_id).where(
+                                closure.c.ancestor_id == child_id
+                            )
+                        ),
+                        closure.c.ancestor_id.in_(
+                            select(closure.c.ancestor_id).where(
+                                closure.c.descendant_id == child_id,
+                                closure.c.ancestor_id != child_id,
+                            )
+                        ),
+                    )
+                )
+            linked += 1
+            if parent_id is None:
+                continue
+            session.execute(
+                insert(ChildCategory).values(
+                    parent_category_id=parent_id, child_category_id=child_id
+                )
+            )
+            session.execute(
+                insert(closure).from_select(
+                    ["ancestor_id", "descendant_id", "depth"],
+                    select(
+                        ancestor.c.ancestor_id,
+                        descendant.c.descendant_id,
+                        ancestor.c.depth + descendant.c.depth + 1,
+                    )
+                    .join(descendant, descendant.c.ancestor_id == child_id)
+                    .where(ancestor.c.descendant_id == parent_id),
+                )
+            )
+        return linked
+
+    def rebuild_category_closure(self, force: bool = False) -> int:
+        """
+        Recompute `CategoryClosure` from the `ChildCategory` edges with a
+        recursive query, for databases written before the closure existed.
+        Unless `force` is set an existing closure is kept. Return the number
+        of closure rows.
+        """
+        closure = CategoryClosure.__table__
+        count_rows = select(func.count()).select_from(closure)
+        if not force:
+            with self._Session() as session:
+                rows = session.scalar(count_rows)
+            if rows:
+                return rows
+        tree = (
+            select(
+                Category.category_id.label("ancestor_id"),
+                Category.category_id.label("descendant_id"),
+                literal(0).label("depth"),
+            )
+        ).cte("tree", recursive=True)
+        tree = tree.union_all(
+            select(
+                tree.c.ancestor_id,
+                ChildCategory.child_category_id,
+                tree.c.depth + 1,
+            ).join(
+                ChildCategory,
+                ChildCategory.parent_category_id == tree.c.descendant_id,
+            )
+        )
+        with self._Session.begin() as session:
+            session.execute(delete(closure))
+            session.execute(
+                insert(closure)
+                .prefix_with("OR IGNORE")
+                .from_select(
+                    ["ancestor_id", "descendant_id", "depth"],
+                    select(
+                        tree.c.ancestor_id, tree.c.descendant_id, tree.c.depth
+                    ),
+                )
+            )
+            return session.scalar(count_rows)
+
+    def find_products_in_category(self, name: str) -> list[Product]:
+        """
+        Find the products of the named category and of every category below
+        it, with a single join through the category closure.
+        """
+        stmt = (
+            select(Product)
+            .join(
+                CategoryClosure,
+                CategoryClosure.descendant_id == Product.category_id,
+            )
+            .join(
+                Category, Category.category_id == CategoryClosure.ancestor_id
+            )
+            .where(Category.name == _normalize_name(name))
+        )
+        with self._Session() as session:
+            return list(session.scalars(stmt))
+
+    def search_products(self, words: str, limit: int = 20) -> list[Product]:
+        """
+        Find up to `limit` products matching every word of `words` in their
+        SKU, EAN, title or descriptions through the full-text index, best
+        match first by bm25 rank. Retired products are left out.
+        """
+        match = search_query(words)
+        if not match:
+            return []
+        weights = ", ".join(
+            str(SEARCH_WEIGHTS[column]) for column in SEARCH_COLUMNS
+        )
+        stmt = text(
+            "SELECT products.* FROM products_fts"
+            " JOIN products ON products.product_id = products_fts.rowid"
+            " WHERE products_fts MATCH :match"
+            " AND products.retired_at IS NULL"
+            f" ORDER BY bm25(products_fts, {weights})"
+            " LIMIT :limit"
+        ).bindparams(match=match, limit=limit)
+        with self._Session() as session:
+            return list(session.scalars(select(Product).from_statement(stmt)))
+
+    def stock_history(self, sku: str, days: int = 30) -> list[PricePoint]:
+        """
+        Return the price and stock recorded for the product with the given
+        SKU over the last `days` days, oldest first, starting with the values
+        it already had when the period began.
+        """
+        start = int(time.time()) - days * 86400
+        history = PriceStockHistory.__table__
+        product_id = (
+            select(Product.product_id)
+            .where(Product.sku == sku.strip())
+            .scalar_subquery()
+        )
+        first = (
+            select(func.coalesce(func.max(history.c.recorded_at), start))
+            .where(
+                history.c.product_id == product_id,
+                history.c.recorded_at <= start,
+            )
+            .scalar_subquery()
+        )
+        stmt = (
+            select(
+                history.c.recorded_at, history.c.uk_price, history.c.uk_stock
+            )
+            .where(
+                history.c.product_id == product_id,
+                history.c.recorded_at >= first,
+            )
+            .order_by(history.c.recorded_at)
+        )
+        with self._Session() as session:
+            return [PricePoint(*row) for row in session.execute(stmt)]
+
+    def price_changes(self, since: int | None = None) -> list[PriceChange]:
+        """
+        Return every price change recorded at or after `since` (default: the
+        start of today), oldest first. A product that is new since then has
+        no previous price and so is not listed.
+        """
+        if since is None:
+            since = start_of_today()
+        history = PriceStockHistory.__table__
+        previous = history.alias("previous")
+        old_price = (
+            select(previous.c.uk_price)
+            .where(
+                previous.c.product_id == history.c.product_id,
+                previous.c.recorded_at < history.c.recorded_at,
+            )
+            .order_by(previous.c.recorded_at.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        changes = (
+            select(
+                history.c.product_id,
+                history.c.recorded_at,
+                old_price.label("old_price"),
+                history.c.uk_price,
+            )
+            .where(history.c.recorded_at >= since)
+            .subquery()
+        )
+        stmt = (
+            select(
+                Product.sku,
+                changes.c.recorded_at,
+                changes.c.old_price,
+                changes.c.uk_price,
+            )
+            .join(Product, Product.product_id == changes.c.product_id)
+            .where(changes.c.old_price != changes.c.uk_price)
+            .order_by(changes.c.recorded_at, changes.c.product_id)
+        )
+        with self._Session() as session:
+            return [PriceChange(*row) for row in session.execute(stmt)]
+
+    def _refresh_images(
+        self,
+        session: Session,
+        batch: PreparedBatch,
+        image_ids: dict,
+        pending: list,
+    ) -> int:
+        """
+        Update the stored metadata of any of the batch's images that has
+        changed since it was inserted and return how many were updated.
+        """
+        images = Image.__table__
+        stmt = select(*(images.c[name] for name in ImageRow._fields)).where(
+            images.c.image_id.in_(list(image_ids.values()))
+        )
+        rows = []
+        for stored in session.execute(stmt):
+            image = batch.images[stored.fullpath]
+            if tuple(stored[1:]) != image[1:]:
+                image = image._replace(image_id=stored.image_id)
+                rows.append(image[1:] + image[:1])
+                pending.append((self._images, image.fullpath, image))
+        self._executemany(
+            session,
+            "update images",
+            lambda: update(images)
+            .where(images.c.image_id == bindparam("b_image_id"))
+            .values({name: bindparam(f"b_{name}") for name in IMAGE_FIELDS}),
+            [f"b_{name}" for name in IMAGE_FIELDS + ("image_id",)],
+            rows,
+        )
+        return len(rows)
+
+    def _link_images(
+        self,
+        session: Session,
+        batch: PreparedBatch,
+        product_ids: dict,
+        image_ids: dict,
+        result: BatchResult,
+    ) -> None:
+        """
+        Insert the image links and then the default image of each SKU. Raise
+        `DefaultImageError` with the offending SKUs, before the default
+        images are set, if a default image is not among its product's linked
+        images; the batch's transaction is then rolled back.
+        """
+        link_rows = [
+            (product_id, image_ids[fullpath])
+            for sku, product_id in product_ids.items()
+            for fullpath in batch.product_images[sku]
+        ]
+        product_images = ProductImage.__table__
+        self._executemany(
+            session,
+            "insert product_images",
+            lambda: insert(product_images).values(
+                product_id=bindparam("product_id"),
+                image_id=bindparam("image_id"),
+            ),
+            ["product_id", "image_id"],
+            link_rows,
+        )
+        result.product_images += len(link_rows)
+        # Default images are only set once their product link exists.
+        default_rows = [
+            (image_ids[batch.default_images[sku]], product_id)
+            for sku, product_id in product_ids.items()
+            if sku in batch.default_images
+        ]
+        unlinked = self._unlinked_default_images(
+            session, product_ids, default_rows
+        )
+        if unlinked:
+            raise DefaultImageError(unlinked)
+        products = Product.__table__
+        self._executemany(
+            session,
+            "update products default_image_id",
+            lambda: update(products)
+            .where(products.c.product_id == bindparam("b_product_id"))
+            .values(default_image_id=bindparam("b_default_image_id")),
+            ["b_default_image_id", "b_product_id"],
+            default_rows,
+        )
+
+    def _unlinked_default_images(
+        self, session: Session, product_ids: dict, default_rows: list
+    ) -> list[str]:
+        """
+        Return the SKUs whose (default image id, product id) pair in
+        `default_rows` has no `ProductImage` row, with one set-based query
+        per chunk of pairs.
+        """
+        pairs = {
+            (product_id, image_id) for image_id, product_id in default_rows
+        }
+        links = ProductImage.__table__
+        for chunk in _chunked(list(pairs), 500):
+            stmt = select(links.c.product_id, links.c.image_id).where(
+                tuple_(links.c.product_id, links.c.image_id).in_(chunk)
+            )
+            pairs.difference_update(session.execute(stmt).tuples())
+        unlinked = {product_id for product_id, image_id in pairs}
+        return [
+            sku
+            for sku, product_id in product_ids.items()
+            if product_id in unlinked
+        ]
+
+    def _write_new_products(
+        self,
+        session: Session,
+        batch: PreparedBatch,
+        skus: list[str],
+        result: BatchResult,
+        pending: list,
+    ) -> list[int]:
+        """
+        Insert the given SKUs of a batch along with their related rows and
+        return their new product ids.
+        """
+        foreign_keys, image_ids = self._resolve_related(
+            session, batch, skus, result, pending
+        )
+        now = int(time.time())
+        product_rows = [
+            batch.products[sku] + foreign_keys[sku] + (batch.hashes[sku], now)
+            for sku in skus
+        ]
+        products = Product.__table__
+        self._executemany(
+            session,
+            "insert products",
+            lambda: insert(products).values(
+                {name: bindparam(name) for name in PRODUCT_INSERT_FIELDS}
+            ),
+            list(PRODUCT_INSERT_FIELDS),
+            product_rows,
+        )
+        # The driver's executemany cannot return the new ids.
+        stmt = select(products.c.sku, products.c.product_id).where(
+            products.c.sku.in_(skus)
+        )
+        product_ids = dict(session.execute(stmt).all())
+        pending.extend(
+            (self._products, sku, pid) for sku, pid in product_ids.items()
+        )
+        result.products = len(product_ids)
+        self._link_images(session, batch, product_ids, image_ids, result)
+        return list(product_ids.values())
+
+    def _update_products(
+        self,
+        session: Session,
+        batch: PreparedBatch,
+        product_ids: dict,
+        result: BatchResult,
+        pending: list,
+    ) -> None:
+        """
+        Rewrite the given changed SKUs of a batch, mapped to their product
+        ids, and replace their image links. Retired products are reinstated.
+        """
+        skus = list(product_ids)
+        foreign_keys, image_ids = self._resolve_related(
+            session, batch, skus, result, pending
+        )
+        result.images += self._refresh_images(
+            session, batch, image_ids, pending
+        )
+        now = int(time.time())
+        product_rows = [
+            batch.products[sku]
+            + foreign_keys[sku]
+            + (batch.hashes[sku], now, None, None, product_ids[sku])
+            for sku in skus
+        ]
+        fields = PRODUCT_INSERT_FIELDS + ("default_image_id", "retired_at")
+        products = Product.__table__
+        session.execute(
+            delete(ProductImage.__table__).where(
+                ProductImage.product_id.in_(list(product_ids.values()))
+            )
+        )
+        self._executemany(
+            session,
+            "update products",
+            lambda: update(products)
+            .where(products.c.product_id == bindparam("b_product_id"))
+            .values({name: bindparam(f"b_{name}") for name in fields}),
+            [f"b_{name}" for name in fields + ("product_id",)],
+            product_rows,
+        )
+        result.updated = len(product_rows)
+        self._link_images(session, batch, product_ids, image_ids, result)
+
+    def defer_child_links(self, child_skus: dict) -> None:
+        """
+        Remember the child SKUs of each given parent SKU until
+        `link_child_products` is called, so that children appearing later in
+        the feed than their parents can still be resolved.
+        """
+        self._child_skus.update(child_skus)
+
+    def _store_child_links(
+        self, session: Session, run_id: int, child_skus: dict
+    ) -> None:
+        """Store the child SKUs of each parent SKU with the given run."""
+        if not child_skus:
+            return
+        session.execute(
+            sqlite_insert(PendingChildLink.__table__).prefix_with(
+                "OR REPLACE"
+            ),
+            [
+                {
+                    "run_id": run_id,
+                    "parent_sku": parent_sku,
+                    "child_skus": json.dumps(children),
+                }
+                for parent_sku, children in child_skus.items()
+            ],
+        )
+
+    def _product_ids(self, session: Session, skus) -> dict:
+        """Map the given SKUs to product ids, reading the cache first."""
+        product_ids = {}
+        lookup = []
+        for sku in skus:
+            hit, product_id = self._products.lookup(sku)
+            if product_id is not None:
+                product_ids[sku] = product_id
+            elif not hit:
+                lookup.append(sku)
+        for chunk in _chunked(lookup, 500):
+            stmt = select(Product.sku, Product.product_id).where(
+                Product.sku.in_(chunk)
+            )
+            for sku, product_id in session.execute(stmt):
+                product_ids[sku] = product_id
+                self._products.put(sku, product_id)
+        return product_ids
+
+    def link_child_products(
+        self, run_id: int | None = None
+    ) -> ChildLinkResult:
+        """
+        Resolve the deferred parent/child SKU pairs, and those stored with
+        `run_id` if given, to product ids and bring the `ChildProduct` rows
+        of those parents in line with them, using one bulk insert and one
+        bulk delete. The stored pairs are removed in the same transaction.
+        Pairs whose child (or parent) SKU is not in the database are
+        returned as unresolved.
+        """
+        child_skus, self._child_skus = self._child_skus, {}
+        result = ChildLinkResult()
+        links = ChildProduct.__table__
+        pending = PendingChildLink.__table__
+        with self._Session.begin() as session:
+            if run_id is not None:
+                stmt = select(
+                    pending.c.parent_sku, pending.c.child_skus
+                ).where(pending.c.run_id == run_id)
+                for parent_sku, children in session.execute(stmt):
+                    child_skus.setdefault(parent_sku, json.loads(children))
+                session.execute(
+                    delete(pending).where(pending.c.run_id == run_id)
+                )
+            skus = set(child_skus)
+            for children in child_skus.values():
+                skus.update(children)
+            product_ids = self._product_ids(session, skus)
+            wanted = set()
+            for parent_sku, children in child_skus.items():
+                parent_id = product_ids.get(parent_sku)
+                for child_sku in children:
+                    result.pairs += 1
+                    child_id = product_ids.get(child_sku)
+                    if parent_id is None or child_id is None:
+                        result.unresolved.append((parent_sku, child_sku))
+                    elif child_id != parent_id:
+                        wanted.add((parent_id, child_id))
+            parent_ids = [
+                product_ids[sku] for sku in child_skus if sku in product_ids
+            ]
+            existing = set()
+            for chunk in _chunked(parent_ids, 500):
+                stmt = select(
+                    links.c.parent_product_id, links.c.child_product_id
+                ).where(links.c.parent_product_id.in_(chunk))
+                existing.update(session.execute(stmt).tuples())
+            stale = [
+                {"b_parent": parent_id, "b_child": child_id}
+                for parent_id, child_id in existing - wanted
+            ]
+            if stale:
+                session.execute(
+                    delete(links).where(
+                        links.c.parent_product_id == bindparam("b_parent"),
+                        links.c.child_product_id == bindparam("b_child"),
+                    ),
+                    stale,
+                )
+            new = [
+                {"parent_product_id": parent_id, "child_product_id": child_id}
+                for parent_id, child_id in wanted - existing
+            ]
+            if new:
+                session.execute(insert(links), new)
+        result.linked = len(new)
+        result.removed = len(stale)
+        return result
+
+    def mark_seen(self, skus) -> None:
+        """
+        Record SKUs seen in the feed for `retire_missing_products`, in a
+        temporary table on a connection held until then.
+        """
+        if self._seen_connection is None:
+            self._seen_connection = self._engine.connect()
+            SEEN_SKUS.drop(self._seen_connection, checkfirst=True)
+            SEEN_SKUS.create(self._seen_connection)
+        self._seen_connection.execute(
+            insert(SEEN_SKUS).prefix_with("OR IGNORE"),
+            [{"sku": sku} for sku in skus],
+        )
+        self._seen_connection.commit()
+
+    def retire_missing_products(self) -> RetireResult:
+        """
+        Retire the products whose SKU was not marked seen with a single
+        set-based UPDATE against the seen SKUs, then remove every retired
+        product's image and child product links. Retiring also clears the
+        content hash and default image and bumps `updated_at`, so it appears
+        in the change feed. Retired products that were seen have already
+        been reinstated by `write_batch`.
+        """
+        started = time.perf_counter()
+        result = RetireResult()
+        connection = self._seen_connection
+        if connection is None:
+            return result
+        products = Product.__table__
+        seen = select(SEEN_SKUS.c.sku)
+        retired = select(products.c.product_id).where(
+            products.c.retired_at.is_not(None)
+        )
+        now = int(time.time())
+        try:
+            result.seen = connection.scalar(
+                select(func.count()).select_from(SEEN_SKUS)
+            )
+            retired_skus = connection.execute(
+                update(products)
+                .where(
+                    products.c.retired_at.is_(None),
+                    products.c.sku.not_in(seen),
+                )
+                .values(
+                    retired_at=now,
+                    updated_at=now,
+                    content_hash=None,
+                    default_image_id=None,
+                )
+                .returning(products.c.sku, products.c.product_id)
+            ).all()
+            result.retired = len(retired_skus)
+            result.product_images = connection.execute(
+                delete(ProductImage.__table__).where(
+                    ProductImage.product_id.in_(retired)
+                )
+            ).rowcount
+            result.child_products = connection.execute(
+                delete(ChildProduct.__table__).where(
+                    or_(
+                        ChildProduct.parent_product_id.in_(retired),
+                        ChildProduct.child_product_id.in_(retired),
+                    )
+                )
+            ).rowcount
+            connection.commit()
+            self._retired_skus.update(retired_skus)
+        finally:
+            self.discard_seen()
+        result.seconds = time.perf_counter() - started
+        return result
+
+    def discard_seen(self) -> None:
+        """Drop the SKUs marked seen and release their connection."""
+        if self._seen_connection is not None:
+            self._seen_connection.rollback()
+            SEEN_SKUS.drop(self._seen_connection, checkfirst=True)
+            self._seen_connection.commit()
+            self._seen_connection.close()
+            self._seen_connection = None
+
+    def start_run(self, mode: str) -> IngestRun:
+        """
+        Record the start of a new ingest run. The child links stored by
+        earlier runs of the mode are dropped, as those runs can no longer be
+        resumed.
+        """
+        run = IngestRun(
+            mode=mode, status="running", started_at=int(time.time())
+        )
+        with self._Session() as session:
+            session.execute(
+                delete(PendingChildLink).where(
+                    PendingChildLink.run_id.in_(
+                        select(IngestRun.run_id).where(IngestRun.mode == mode)
+                    )
+                )
+            )
+            session.add(run)
+            session.commit()
+        return run
+
+    def find_resumable_run(self, mode: str) -> IngestRun | None:
+        """
+        Return the latest ingest run of the given mode if it is unfinished.
+        An older unfinished run is never resumed once a newer run has
+        started, as that run has since brought the database up to date.
+        """
+        stmt = (
+            select(IngestRun)
+            .where(IngestRun.mode == mode)
+            .order_by(IngestRun.run_id.desc())
+            .limit(1)
+        )
+        with self._Session() as session:
+            run = session.scalar(stmt)
+        if run is None or run.status == "finished":
+            return None
+        return run
+
+    def set_run_status(self, run_id: int, status: str) -> None:
+        """Mark an ingest run as running, failed or finished."""
+        values = {"status": status}
+        if status == "finished":
+            values["finished_at"] = int(time.time())
+        with self._Session.begin() as session:
+            session.execute(
+                update(IngestRun)
+                .where(IngestRun.run_id == run_id)
+                .values(**values)
+            )
+
+    def update_prices(self, nodes: list[dict]) -> BatchResult:
+        """
+        Apply the `ukPrice` and `ukStock` of the given API nodes to existing
+        products with a single keyed executemany UPDATE. Rows whose values
+        are unchanged are matched but not rewritten, and so add nothing to
+        the price and stock history.
+        """
+        started = time.perf_counter()
+        result = BatchResult(nodes=len(nodes))
+        products = Product.__table__
+        stmt = (
+            update(products)
+            .where(products.c.sku == bindparam("b_sku"))
+            .where(
+                or_(
+                    products.c.uk_price.is_not(bindparam("b_price")),
+                    products.c.uk_stock.is_not(bindparam("b_stock")),
+                )
+            )
+            .values(
+                uk_price=bindparam("b_price"),
+                uk_stock=bindparam("b_stock"),
+                updated_at=bindparam("b_updated_at"),
+            )
+        )
+        now = int(time.time())
+        rows = [
+            {
+                "b_sku": node["sku"].strip(),
+                "b_price": node["ukPrice"],
+                "b_stock": node["ukStock"],
+                "b_updated_at": now,
+            }
+            for node in nodes
+        ]
+        if rows:
+            with self._engine.begin() as connection:
+                result.updated = connection.execute(stmt, rows).rowcount
+        result.skipped = len(rows) - result.updated
+        result.seconds = time.perf_counter() - started
+        return result
+
+    def add_batch(self, nodes: list[dict]) -> BatchResult:
+        """Prepare and write a batch of API nodes in a single transaction."""
+        return self.write_batch(self.prepare_batch(nodes))
 
     def find_product(self, sku: str) -> Product | None:
         """Find a Product in the database with the given sku."""
-        stmt = select(Product).where(Product.sku.in_([sku.strip()]))
+        sku = sku.strip()
+        hit, product_id = self._products.lookup(sku)
+        if hit and product_id is None:
+            return None
+        stmt = select(Product).where(Product.sku.in_([sku]))
         with self._Session() as session:
             return session.scalar(stmt)
 
+    def find_product_id(self, sku: str) -> int | None:
+        """Find the id of the Product in the database with the given sku."""
+        sku = sku.strip()
+        hit, product_id = self._products.lookup(sku)
+        if hit:
+            return product_id
+        stmt = select(Product.product_id).where(Product.sku.in_([sku]))
+        with self._Session() as session:
+            product_id = session.scalar(stmt)
+        if product_id is not None:
+            self._products.put(sku, product_id)
+        return product_id
+
     def add_product(self, product: Product) -> Product:
         """Add a Product to the database using the given entity."""
         with self._Session() as session:
             session.add(product)
             session.commit()
-            return product
+        self._products.put(product.sku.strip(), product.product_id)
+        return product
 
-    def find_brand(self, brand: str) -> Brand | None:
-        """Find a Brand in the database with the given name."""
-        stmt = select(Brand).where(Brand.name.in_([brand.strip()]))
+    def find_brand(self, brand: str) -> BrandRow | None:
+        """Find the row of the Brand in the database with the given name."""
+        brand = _normalize_name(brand)
+        hit, brand_row = self._brands.lookup(brand)
+        if hit:
+            return brand_row
+        stmt = select(Brand.brand_id, Brand.name).where(
+            Brand.name.in_([brand])
+        )
         with self._Session() as session:
-            return session.scalar(stmt)
+            row = session.execute(stmt).first()
+        if row is None:
+            return None
+        brand_row = BrandRow(*row)
+        self._brands.put(brand, brand_row)
+        return brand_row
 
     def add_brand(self, brand: str) -> Brand:
         """Add a Brand to the database with the given name."""
-        brand_entity = Brand(name=brand.strip())
+        brand_entity = Brand(name=_normalize_name(brand))
         with self._Session() as session:
             session.add(brand_entity)
             session.commit()
-            return brand_entity
+        self._brands.put(
+            brand_entity.name,
+            BrandRow(brand_entity.brand_id, brand_entity.name),
+        )
+        return brand_entity
+
+    def _associate(self, product: Product, **values) -> None:
+        """Set the given foreign keys of a Product without loading it."""
+        products = Product.__table__
+        with self._engine.begin() as connection:
+            connection.execute(
+                update(products)
+                .where(products.c.product_id == product.product_id)
+                .values(**values)
+            )
+        for name, value in values.items():
+            setattr(product, name, value)
 
     def associate_brand(self, product: Product, brand: Brand) -> None:
         """Associate the given Product with the given Brand."""
-        with self._Session() as session:
-            product = session.merge(product)
-            product.brand_id = brand.brand_id
-            session.commit()
+        self._associate(product, brand_id=brand.brand_id)
 
-    def find_category(self, category: dict) -> Category | None:
-        """Find a Category in the database with the given name."""
-        category_name = category["name"].strip()
-        stmt = select(Category).where(Category.name.is_(category_name))
+    def find_category(self, category: dict) -> CategoryRow | None:
+        """Find the row of the Category in the database with the given name."""
+        category_name = _normalize_name(category["name"])
+        hit, category_row = self._categories.lookup(category_name)
+        if hit:
+            return category_row
+        stmt = select(Category.category_id, Category.name).where(
+            Category.name.is_(category_name)
+        )
         with self._Session() as session:
-            return session.scalar(stmt)
+            row = session.execute(stmt).first()
+        if row is None:
+            return None
+        category_row = CategoryRow(*row)
+        self._categories.put(category_name, category_row)
+        return category_row
 
     def add_category(self, category: dict) -> Category:
         """Add a Category to the database using the given entity."""
-        category_name = category["name"].strip()
+        category_name = _normalize_name(category["name"])
         category_entity = Category(name=category_name)
+        parent = None
+        parent_category_entity = None
         if category["parent"]:
-            parent_category_name = category["parent"]["name"]
-            parent_category_entity = Category(name=parent_category_name)
+            parent = self.find_category(category["parent"])
+            if not parent:
+                parent_category_name = _normalize_name(
+                    category["parent"]["name"]
+                )
+                parent_category_entity = Category(name=parent_category_name)
+                parent = parent_category_entity
         with self._Session() as session:
             session.add(category_entity)
             if parent_category_entity:
                 session.add(parent_category_entity)
+            session.flush()
+            self._link_categories(
+                session,
+                {
+                    category_entity.category_id: (
+                        parent.category_id if parent else None
+                    )
+                },
+            )
             session.commit()
-            return category_entity
+        for entity in filter(None, [category_entity, parent_category_entity]):
+            self._categories.put(
+                entity.name, CategoryRow(entity.category_id, entity.name)
+            )
+        return category_entity
 
     def associate_category(self, product: Product, category: Category) -> None:
         """Associate the given Product with the given Category."""
-        with self._Session() as session:
-            product = session.merge(product)
-            product.category_id = category.category_id
-            session.commit()
+        self._associate(product, category_id=category.category_id)
 
-    def find_image(self, image: dict) -> Image | None:
-        """Find an Image in the database with the given fullpath."""
+    def find_image(self, image: dict) -> ImageRow | None:
+        """Find the row of the Image in the database with this fullpath."""
         if "image" in image:
             fullpath = image["image"]["fullpath"]
         else:
             fullpath = image["fullpath"]
-        stmt = select(Image).where(Image.fullpath.in_([fullpath.strip()]))
+        fullpath = fullpath.strip()
+        hit, image_row = self._images.lookup(fullpath)
+        if hit:
+            return image_row
+        images = Image.__table__
+        stmt = select(*(images.c[name] for name in ImageRow._fields)).where(
+            images.c.fullpath.in_([fullpath])
+        )
         with self._Session() as session:
-            return session.scalar(stmt)
+            row = session.execute(stmt).first()
+        if row is None:
+            return None
+        image_row = ImageRow(*row)
+        self._images.put(fullpath, image_row)
+        return image_row
 
     def add_image(self, image: dict) -> Image:
         """Add an Image to the database using the given entity."""
-        if "image" in image:
-            image = image["image"]
-        image_entity = Image(
-            creation_date=image["creationDate"],
-            filename=image["filename"],
-            fullpath=image["fullpath"].strip(),
-            mimetype=image["mimetype"],
-            modification_date=image["modificationDate"],
-        )
+        image_entity = Image(**image_values(image))
         with self._Session() as session:
             session.add(image_entity)
             session.commit()
-            return image_entity
+        self._images.put(
+            image_entity.fullpath,
+            image_row(image)._replace(image_id=image_entity.image_id),
+        )
+        return image_entity
 
     def associate_image(
         self, product: Product, image: Image, is_default=False
     ) -> None:
+        """
+        Link the given Image to the given Product, optionally as its default.
+        The database rejects a default image that is not linked, so the link
+        is written first.
+        """
         with self._Session() as session:
-            # Attach product to this session and ensure relationship is populated
-            product_in_session = session.merge(product)
-            product_image_link = ProductImage(
-                product_id=product_in_session.product_id,
-                image_id=image.image_id,
-            )
-            # add via relationship so validate_default_image sees the link
-            product_in_session.images.append(product_image_link)
+            session.add(
+                ProductImage(
+                    product_id=product.product_id, image_id=image.image_id
+                )
+            )
+            session.flush()
             if is_default:
-                product_in_session.default_image_id = image.image_id
+                session.execute(
+                    update(Product)
+                    .where(Product.product_id == product.product_id)
+                    .values(default_image_id=image.image_id)
+                )
             session.commit()
+        if is_default:
+            product.default_image_id = image.image_id
 
 
-if __name__ == "__main__":
-    qm = ApiQueryManager()
-    df = DatabaseFacade(engine)
-    create_tables(engine)
-    total_count = 1
+def _chunked(iterable, size: int):
+    """Yield lists of up to `size` items from the given iterable."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def ingest_per_product(qm: ApiQueryManager, df: DatabaseFacade) -> int:
+    """
+    Ingest each product with its own set of transactions and return the
+    number of products fetched.
+    """
+    total_count = 0
     added_count = 0
     brands_count = 0
     category_count = 0
     image_count = 0
     for product in qm.get_products():
-        if not df.find_product(product["sku"]):
+        if df.find_product_id(product["sku"]) is None:
             # Product creation
-            p = Product(
-                uk_price=product["ukPrice"],
-                uk_stock=product["ukStock"],
-                width=product["width"],
-                creation_date=product["creationDate"],
-                depth=product["depth"],
-                description=product["description"],
-                dimensions=product["dimensions"],
-                ean=product["ean"],
-                sku=product["sku"],
-                gross_weight=product["grossWeight"],
-                height=product["height"],
-                length=product["length"],
-                long_description=product["longDescription"],
-                net_weight=product["netWeight"],
-                title=product["title"],
-            )
+            p = Product(**product_values(product), updated_at=int(time.time()))
             added_p = df.add_product(p)
             added_count += 1
             # Brand assocation/creation
@@ -336,7 +2309,13 @@ if __name__ == "__main__":
                     existing_image = df.add_image(product_default_image)
                     image_count += 1
                 df.associate_image(added_p, existing_image, True)
-
+        df.defer_child_links(
+            {
+                product["sku"].strip(): [
+                    child["sku"].strip() for child in product["children"] or []
+                ]
+            }
+        )
         total_count += 1
     print(
         total_count,
@@ -352,4 +2331,506 @@ if __name__ == "__main__":
         image_count,
         "images.",
     )
+    _print_child_links(df.link_child_products())
+    return total_count
+
+
+def _print_retired(result: RetireResult) -> None:
+    print(
+        f"{result.seen} SKUs in the feed: {result.retired} products retired,",
+        f"{result.product_images} image and {result.child_products}",
+        "child product links removed",
+        f"in {result.seconds:.3f}s.",
+    )
+
+
+def _print_child_links(result: ChildLinkResult) -> None:
+    print(
+        f"{result.pairs} parent/child product pairs:",
+        f"{result.linked} linked, {result.removed} removed,",
+        f"{len(result.unresolved)} unresolved.",
+    )
+    for parent_sku, child_sku in result.unresolved[:10]:
+        print(f"Unresolved child {child_sku!r} of {parent_sku!r}.")
+    if len(result.unresolved) > 10:
+        print(f"... and {len(result.unresolved) - 10} more.")
+
+
+def ingest_batches(
+    qm: ApiQueryManager,
+    df: DatabaseFacade,
+    batch_size: int | None = None,
+    queue_size: int | None = None,
+    sync: bool = False,
+    run_id: int | None = None,
+    metrics: Metrics | None = None,
+    retire_missing: bool = False,
+) -> tuple[BatchResult, list[StageStats]]:
+    """
+    Ingest products one batch per transaction. Without a `batch_size` each
+    API page is written as a batch. With a `queue_size` fetching, transforming
+    and writing run as concurrent pipeline stages joined by queues of that
+    size. With `sync` existing products are updated if they have changed.
+    With a `run_id` each batch advances that run's committed watermark.
+    Each batch's fetch, transform and write time is recorded in `metrics`.
+    With `retire_missing` the SKUs of every batch are marked seen, and once
+    the whole feed has been read the products missing from it are retired.
+    Return the totals and the fetch, transform and write stage timings.
+    """
+    metrics = metrics or Metrics()
+    if batch_size:
+        batches = _chunked(qm.get_products(), batch_size)
+    else:
+        batches = qm.get_pages()
+    batches = metrics.timed_iter("stage.fetch", batches)
+    transform = metrics.timed("stage.transform", df.prepare_batch)
+    totals = BatchResult()
+    numbers = count(1)
+
+    def write(batch: PreparedBatch) -> None:
+        result = df.write_batch(batch, sync, run_id, qm.total_count)
+        if retire_missing:
+            df.mark_seen(batch.products)
+        totals.add(result)
+        print(
+            f"Batch {next(numbers)}: {result.nodes} nodes,",
+            f"{result.products} products added,",
+            f"{result.updated} updated,",
+            f"{result.rows} rows in {result.seconds:.3f}s",
+            f"({result.rows_per_second:.0f} rows/sec).",
+        )
+
+    write = metrics.timed("stage.write", write)
+    if queue_size:
+        pipeline = Pipeline(batches, transform, write, queue_size)
+        stages = pipeline.run()
+    else:
+        stages = [StageStats(name) for name in ("fetch", "transform", "write")]
+        batches = iter(batches)
+        while True:
+            started = time.perf_counter()
+            nodes = next(batches, None)
+            fetched = time.perf_counter()
+            stages[0].busy_seconds += fetched - started
+            if nodes is None:
+                break
+            batch = transform(nodes)
+            prepared = time.perf_counter()
+            stages[1].busy_seconds += prepared - fetched
+            write(batch)
+            stages[2].busy_seconds += time.perf_counter() - prepared
+            for stats in stages:
+                stats.items += 1
+    for stats in stages:
+        print(
+            f"{stats.name} stage: {stats.items} batches,",
+            f"busy {stats.busy_seconds:.3f}s,",
+            f"waiting on input {stats.starved_seconds:.3f}s,",
+            f"blocked on output {stats.blocked_seconds:.3f}s,",
+            f"queue depth max {stats.max_queue_depth}",
+            f"mean {stats.mean_queue_depth:.1f}.",
+        )
+    print(
+        totals.nodes,
+        "products fetched from API.",
+        totals.products,
+        "added to database,",
+        totals.updated,
+        f"updated ({totals.reinstated} reinstated),",
+        totals.skipped,
+        "unchanged.",
+    )
+    metrics.increment("products.reinstated", totals.reinstated)
+    print(
+        totals.brands,
+        "brands,",
+        totals.categories,
+        "categories,",
+        totals.images,
+        "images.",
+    )
+    print(
+        f"{totals.rows} rows written in {totals.seconds:.3f}s",
+        f"({totals.rows_per_second:.0f} rows/sec).",
+    )
+    _print_child_links(df.link_child_products(run_id))
+    if retire_missing:
+        # A feed that ended early would retire everything it did not reach.
+        if totals.nodes and totals.nodes >= (qm.total_count or 0):
+            retired = df.retire_missing_products()
+            metrics.increment("products.retired", retired.retired)
+            _print_retired(retired)
+        else:
+            df.discard_seen()
+            print(
+                f"Only {totals.nodes} of {qm.total_count} products read;",
+                "not retiring missing products.",
+            )
+    return totals, stages
+
+
+def sync_prices(qm: ApiQueryManager, df: DatabaseFacade) -> BatchResult:
+    """Apply the price and stock of every product, one API page at a time."""
+    totals = BatchResult()
+    for number, nodes in enumerate(qm.get_pages(), start=1):
+        result = df.update_prices(nodes)
+        totals.add(result)
+        print(
+            f"Page {number}: {result.nodes} products,",
+            f"{result.updated} updated in {result.seconds:.3f}s.",
+        )
+    print(
+        totals.nodes,
+        "prices fetched from API.",
+        totals.updated,
+        "updated,",
+        totals.skipped,
+        "unchanged or unknown.",
+    )
+    return totals
+
+
+def _print_rate_limiter_stats(qm: ApiQueryManager) -> None:
+    stats = qm.rate_limiter_stats()
+    print(
+        f"API: {stats['requests']} requests,",
+        f"{stats['throttles']} throttled,",
+        f"{stats['throttled_seconds']:.3f}s waiting out throttling,",
+        f"{stats['paced_seconds']:.3f}s paced by the rate limiter,",
+        f"final rate {stats['rate']:.1f}/s,",
+        f"final page size {stats['page_size']}.",
+    )
+
+
+def _print_response_cache_stats(response_cache: ResponseCache | None) -> None:
+    if response_cache is None:
+        return
+    stats = response_cache.stats()
+    print(
+        f"Response cache: {stats['pages']} pages stored,",
+        f"{stats['recorded']} recorded, {stats['replayed']} replayed.",
+    )
+
+
+def _ingest(args: argparse.Namespace, metrics: Metrics) -> dict:
+    """Run the ingest selected by the parsed command line options."""
+    memory_budget = None
+    if args.memory_budget:
+        memory_budget = int(args.memory_budget * 1024 * 1024)
+    response_cache = None
+    if args.record_responses or args.replay_responses:
+        response_cache = ResponseCache(
+            args.replay_responses or args.record_responses
+        )
+    db_engine = engine
+    if args.profile:
+        db_engine = create_profile_engine(database_name, args.profile)
+    rate_limiter = RateLimiter(args.rate, burst=args.concurrency)
+    if args.prices:
+        qm = ApiQueryManager(
+            args.concurrency,
+            PRICE_STOCK_QUERY,
+            args.page_size or 1000,
+            rate_limiter,
+            not args.fixed_page_size,
+            metrics=metrics,
+            response_cache=response_cache,
+            replay=bool(args.replay_responses),
+            stream=args.stream,
+            memory_budget=memory_budget,
+        )
+        df = DatabaseFacade(db_engine, args.cache_size, metrics)
+        create_tables(db_engine)
+        totals = sync_prices(qm, df)
+        _print_rate_limiter_stats(qm)
+        _print_response_cache_stats(response_cache)
+        return {
+            "mode": "prices",
+            "products": totals.nodes,
+            "result": asdict(totals),
+            "stages": [],
+            "rate_limiter": qm.rate_limiter_stats(),
+        }
+
+    df = DatabaseFacade(db_engine, args.cache_size, metrics)
+    create_tables(db_engine, args.defer_indexes)
+    df.rebuild_category_closure()
+    df.warm_cache()
+    if not (args.bulk or args.sync or args.pipeline or args.resume):
+        qm = ApiQueryManager(
+            args.concurrency,
+            page_size=args.page_size or 100,
+            rate_limiter=rate_limiter,
+            adaptive_page_size=not args.fixed_page_size,
+            metrics=metrics,
+            response_cache=response_cache,
+            replay=bool(args.replay_responses),
+            stream=args.stream,
+            memory_budget=memory_budget,
+        )
+        summary = {"mode": "legacy", "result": None, "stages": []}
+        summary["products"] = ingest_per_product(qm, df)
+    else:
+        mode = "sync" if args.sync else "bulk"
+        run = df.find_resumable_run(mode) if args.resume else None
+        if run:
+            print(
+                f"Resuming run {run.run_id} from offset",
+                f"{run.committed_offset} of {run.total_count}",
+                f"({run.committed_pages} batches committed).",
+            )
+            df.set_run_status(run.run_id, "running")
+        else:
+            run = df.start_run(mode)
+        # A resumed run has not seen the SKUs of the batches before it.
+        retire_missing = not args.keep_missing and run.committed_offset == 0
+        qm = ApiQueryManager(
+            args.concurrency,
+            page_size=args.page_size or 100,
+            rate_limiter=rate_limiter,
+            adaptive_page_size=not args.fixed_page_size,
+            start_offset=run.committed_offset,
+            metrics=metrics,
+            response_cache=response_cache,
+            replay=bool(args.replay_responses),
+            stream=args.stream,
+            memory_budget=memory_budget,
+        )
+        try:
+            totals, stages = ingest_batches(
+                qm,
+                df,
+                args.batch_size,
+                args.queue_size if args.pipeline else None,
+                args.sync,
+                run.run_id,
+                metrics,
+                retire_missing,
+            )
+        except BaseException:
+            df.set_run_status(run.run_id, "failed")
+            raise
+        df.set_run_status(run.run_id, "finished")
+        summary = {
+            "mode": mode,
+            "products": totals.nodes,
+            "result": asdict(totals),
+            "stages": [stats.as_dict() for stats in stages],
+        }
+    if args.defer_indexes:
+        started = time.perf_counter()
+        create_indexes(db_engine)
+        summary["index_seconds"] = time.perf_counter() - started
+        metrics.observe("stage.index_rebuild", summary["index_seconds"])
+        print(f"Indexes rebuilt in {summary['index_seconds']:.3f}s.")
+    _print_rate_limiter_stats(qm)
+    _print_response_cache_stats(response_cache)
+    for name, stats in df.cache_stats().items():
+        print(
+            f"{name} cache: {stats['entries']} entries,",
+            f"{stats['hits']} hits, {stats['misses']} misses,",
+            f"{stats['evictions']} evictions.",
+        )
     print('Finding Product "7950.5345": ', df.find_product("7950.5345"))
+    summary["rate_limiter"] = qm.rate_limiter_stats()
+    summary["caches"] = df.cache_stats()
+    return summary
+
+
+def _print_metrics(metrics: Metrics, top: int = 5) -> None:
+    report = metrics.report()
+    for name, stats in report["timers"].items():
+        print(
+            f"{name}: {stats['count']} x,",
+            f"{stats['seconds']:.3f}s total,",
+            f"{stats['max_seconds']:.3f}s max.",
+        )
+    for name, value in report["counters"].items():
+        print(f"{name}: {value}.")
+    for row in report["sql"][:top]:
+        print(
+            f"SQL {row['operation']} {row['table']}:",
+            f"{row['count']} statements,",
+            f"{row['parameter_sets']} parameter sets,",
+            f"{row['seconds']:.3f}s.",
+        )
+
+
+def main(argv=None):
+    """Run the ingest and return a summary of the run's counters."""
+    parser = argparse.ArgumentParser(
+        description="Fetch products from the Combisteel API into the database."
+    )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="write products in batches, one transaction per batch",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=None,
+        help="nodes per bulk batch (default: one API page)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=None,
+        help="maximum entries per lookup cache (default: unbounded, 0 disables)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="API pages fetched concurrently (default: 1, sequential)",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="run fetch, transform and write as concurrent stages (implies --bulk)",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=4,
+        help="batches buffered between pipeline stages, at least 1 (default: 4)",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="update existing products whose content has changed (implies --bulk)",
+    )
+    parser.add_argument(
+        "--keep-missing",
+        action="store_true",
+        help="do not retire products missing from the feed after a full run",
+    )
+    parser.add_argument(
+        "--prices",
+        action="store_true",
+        help="only refresh the price and stock of existing products",
+    )
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=None,
+        help="products per API page (default: 100, or 1000 with --prices)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=10.0,
+        help="initial API requests per second, adapted as the run goes",
+    )
+    parser.add_argument(
+        "--fixed-page-size",
+        action="store_true",
+        help="keep the page size fixed instead of adapting it",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the last interrupted run from its committed offset "
+        "(implies --bulk)",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=sorted(PROFILES),
+        default=None,
+        help="SQLite engine profile (default: DATABASE_PROFILE or 'default')",
+    )
+    parser.add_argument(
+        "--defer-indexes",
+        action="store_true",
+        help=(
+            "drop secondary indexes and the search index triggers during the"
+            " load, then rebuild them"
+        ),
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help=(
+            "decode each API page incrementally as it is received; pages are"
+            " fetched one at a time, so it cannot be combined with"
+            " --concurrency, --record-responses or --replay-responses"
+        ),
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=float,
+        metavar="MB",
+        help="bound the decoded nodes held at once, and so the page size",
+    )
+    responses = parser.add_mutually_exclusive_group()
+    responses.add_argument(
+        "--record-responses",
+        metavar="DIR",
+        help="store every raw API page in a compressed response cache",
+    )
+    responses.add_argument(
+        "--replay-responses",
+        metavar="DIR",
+        help=(
+            "read the API pages from a response cache instead of the API, one"
+            " at a time (cannot be combined with --stream or --concurrency)"
+        ),
+    )
+    parser.add_argument(
+        "--metrics-json",
+        metavar="PATH",
+        help="write the run's SQL, API and stage metrics as JSON",
+    )
+    parser.add_argument(
+        "--metrics-prom",
+        metavar="PATH",
+        help="write the run's metrics in the Prometheus text format",
+    )
+    parser.add_argument(
+        "--sample-profile",
+        metavar="PATH",
+        help="sample Python stacks during the run and write them collapsed",
+    )
+    parser.add_argument(
+        "--sample-interval",
+        type=float,
+        default=0.01,
+        help="seconds between profiler samples (default: 0.01)",
+    )
+    args = parser.parse_args(argv)
+    if args.queue_size < 1:
+        parser.error("--queue-size must be at least 1")
+    if args.stream and args.record_responses:
+        parser.error("--record-responses cannot be combined with --stream")
+    if args.replay_responses and args.stream:
+        parser.error("--replay-responses cannot be combined with --stream")
+    if args.replay_responses and args.concurrency > 1:
+        parser.error(
+            "--replay-responses cannot be combined with --concurrency"
+        )
+    if args.stream and args.concurrency > 1:
+        parser.error("--concurrency cannot be combined with --stream")
+
+    metrics = Metrics()
+    profiler = None
+    if args.sample_profile:
+        profiler = SamplingProfiler(args.sample_interval)
+        profiler.start()
+    try:
+        summary = _ingest(args, metrics)
+    finally:
+        # Write whatever was collected, even if the run failed.
+        if profiler:
+            profiler.stop()
+            profiler.write(args.sample_profile)
+        if args.metrics_json:
+            metrics.write_json(args.metrics_json)
+        if args.metrics_prom:
+            metrics.write_prometheus(args.metrics_prom)
+    _print_metrics(metrics)
+    summary["metrics"] = metrics.report()
+    return summary
+
+
+if __name__ == "__main__":
+    main()
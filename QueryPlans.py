@@ -0,0 +1,184 @@
+from sqlalchemy import delete, func, select, tuple_, update
+from Models import (
+    Brand,
+    Category,
+    CategoryClosure,
+    ChildCategory,
+    ChildProduct,
+    Image,
+    IngestRun,
+    PendingChildLink,
+    PriceStockHistory,
+    Product,
+    ProductImage,
+)
+
+# Statements run by the ingest and read paths, each of which must be
+# answered from an index rather than a full table scan.
+STATEMENTS = {
+    "product by sku": select(Product).where(Product.sku.in_(["7000.0001"])),
+    "product ids by sku": select(Product.sku, Product.product_id).where(
+        Product.sku.in_(["7000.0001", "7000.0002"])
+    ),
+    "brand by name": select(Brand).where(Brand.name.in_(["Acme"])),
+    "category by name": select(Category).where(Category.name.is_("Fridges")),
+    "categories by name": select(Category).where(
+        Category.name.in_(["Fridges", "Refrigeration"])
+    ),
+    "image by fullpath": select(Image).where(
+        Image.fullpath.in_(["/img/a.jpg"])
+    ),
+    "images by id": select(Image).where(Image.image_id.in_([1, 2])),
+    "products by brand": select(Product).where(Product.brand_id == 1),
+    "products by category": select(Product).where(Product.category_id == 1),
+    "products by default image": select(Product.product_id).where(
+        Product.default_image_id == 1
+    ),
+    "images of product": select(Image)
+    .join(ProductImage, ProductImage.image_id == Image.image_id)
+    .where(ProductImage.product_id == 1),
+    "products of image": select(Product)
+    .join(ProductImage, ProductImage.product_id == Product.product_id)
+    .where(ProductImage.image_id == 1),
+    "product with brand and category": select(Product, Brand, Category)
+    .join(Brand, Brand.brand_id == Product.brand_id)
+    .join(Category, Category.category_id == Product.category_id)
+    .where(Product.sku == "7000.0001"),
+    "children of product": select(ChildProduct).where(
+        ChildProduct.parent_product_id == 1
+    ),
+    "parents of product": select(ChildProduct).where(
+        ChildProduct.child_product_id == 1
+    ),
+    "children of category": select(ChildCategory).where(
+        ChildCategory.parent_category_id == 1
+    ),
+    "parents of category": select(ChildCategory).where(
+        ChildCategory.child_category_id == 1
+    ),
+    "products in category subtree": select(Product)
+    .join(
+        CategoryClosure, CategoryClosure.descendant_id == Product.category_id
+    )
+    .join(Category, Category.category_id == CategoryClosure.ancestor_id)
+    .where(Category.name == "Refrigeration"),
+    "ancestors of category": select(CategoryClosure).where(
+        CategoryClosure.descendant_id == 1
+    ),
+    "current category parents": select(
+        ChildCategory.child_category_id, ChildCategory.parent_category_id
+    ).where(ChildCategory.child_category_id.in_([1, 2])),
+    "products page by brand": select(Product)
+    .where(
+        Product.brand_id
+        == select(Brand.brand_id)
+        .where(Brand.name == "Acme")
+        .scalar_subquery(),
+        Product.product_id > 100,
+        Product.retired_at.is_(None),
+    )
+    .order_by(Product.product_id)
+    .limit(101),
+    "products page in category subtree": select(Product)
+    .where(
+        Product.category_id.in_(
+            select(CategoryClosure.descendant_id)
+            .join(
+                Category, Category.category_id == CategoryClosure.ancestor_id
+            )
+            .where(Category.name == "Refrigeration")
+        ),
+        Product.product_id > 100,
+        Product.retired_at.is_(None),
+    )
+    .order_by(Product.product_id)
+    .limit(101),
+    "products changed since": select(Product)
+    .where(
+        tuple_(Product.updated_at, Product.product_id)
+        > tuple_(1700000000, 100)
+    )
+    .order_by(Product.updated_at, Product.product_id)
+    .limit(101),
+    "resumable run": select(IngestRun)
+    .where(IngestRun.mode == "bulk")
+    .order_by(IngestRun.run_id.desc())
+    .limit(1),
+    "pending child links of run": select(PendingChildLink).where(
+        PendingChildLink.run_id == 1
+    ),
+    "drop pending child links of mode": delete(PendingChildLink).where(
+        PendingChildLink.run_id.in_(
+            select(IngestRun.run_id).where(IngestRun.mode == "bulk")
+        )
+    ),
+    "image links of products": select(
+        ProductImage.product_id, ProductImage.image_id
+    ).where(ProductImage.product_id.in_([1, 2])),
+    "replace image links": delete(ProductImage).where(
+        ProductImage.product_id.in_([1, 2])
+    ),
+    "update price by sku": update(Product.__table__)
+    .where(Product.__table__.c.sku == "7000.0001")
+    .values(uk_price=1.0),
+    "price and stock history of product": select(PriceStockHistory)
+    .where(
+        PriceStockHistory.product_id == 1,
+        PriceStockHistory.recorded_at
+        >= select(func.max(PriceStockHistory.recorded_at))
+        .where(
+            PriceStockHistory.product_id == 1,
+            PriceStockHistory.recorded_at <= 1700000000,
+        )
+        .scalar_subquery(),
+    )
+    .order_by(PriceStockHistory.recorded_at),
+    "price and stock changes since": select(PriceStockHistory.product_id)
+    .where(PriceStockHistory.recorded_at >= 1700000000)
+    .order_by(PriceStockHistory.recorded_at),
+}
+
+
+def query_plan(connection, statement) -> list[str]:
+    """Return the `EXPLAIN QUERY PLAN` details of a statement."""
+    compiled = statement.compile(
+        dialect=connection.dialect, compile_kwargs={"literal_binds": True}
+    )
+    rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}")
+    return [row[-1] for row in rows]
+
+
+def full_scans(db_engine, statements: dict = STATEMENTS) -> dict:
+    """
+    Return the plan details of every statement whose plan scans a whole
+    table, keyed by statement name.
+    """
+    problems = {}
+    with db_engine.connect() as connection:
+        for name, statement in statements.items():
+            scans = [
+                detail
+                for detail in query_plan(connection, statement)
+                if detail.startswith("SCAN ")
+            ]
+            if scans:
+                problems[name] = scans
+    return problems
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    from os import path
+    from Engine import create_profile_engine, create_tables
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_engine = create_profile_engine(path.join(directory, "plans.db"))
+        create_tables(db_engine)
+        problems = full_scans(db_engine)
+        db_engine.dispose()
+    for name, details in problems.items():
+        print(f"FULL SCAN in {name!r}: {'; '.join(details)}")
+    indexed = len(STATEMENTS) - len(problems)
+    print(f"{indexed}/{len(STATEMENTS)} statements use indexes.")
+    sys.exit(1 if problems else 0)
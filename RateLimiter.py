@@ -0,0 +1,140 @@
+from email.utils import parsedate_to_datetime
+from threading import Lock
+import asyncio
+import random
+import time
+
+
+class RateLimiter:
+    """
+    Adaptive token bucket shared by every request an `ApiQueryManager` makes,
+    whether sequential or concurrent.
+
+    Requests are released at `rate` per second with bursts of up to `burst`.
+    A throttled (429) response halves the rate and blocks all callers until
+    its `Retry-After` has passed, while successful responses raise the rate
+    additively, or lower it if latency exceeds `target_latency`. Waits are
+    jittered so that blocked callers do not all retry at once. Time spent
+    waiting out a `Retry-After` is counted in `throttled_seconds`, and
+    ordinary pacing by the bucket in `paced_seconds`.
+    """
+
+    def __init__(
+        self,
+        rate: float = 10.0,
+        burst: int | None = None,
+        min_rate: float = 0.2,
+        max_rate: float = 50.0,
+        target_latency: float = 2.0,
+        jitter: float = 0.1,
+    ):
+        """Set up a full bucket releasing `rate` requests per second."""
+        self._rate = rate
+        self._burst = burst or max(1, int(rate))
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._target_latency = target_latency
+        self._jitter = jitter
+        self._tokens = float(self._burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = Lock()
+        self.requests = 0
+        self.throttles = 0
+        self.throttled_seconds = 0.0
+        self.paced_seconds = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @property
+    def target_latency(self) -> float:
+        return self._target_latency
+
+    @staticmethod
+    def retry_after(headers) -> float | None:
+        """
+        Read the delay in seconds from a `Retry-After` header, given either
+        as a number of seconds or as an HTTP date.
+        """
+        value = headers.get("Retry-After") if headers else None
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(
+                0.0, parsedate_to_datetime(value).timestamp() - time.time()
+            )
+        except (TypeError, ValueError):
+            return None
+
+    def _reserve(self) -> float:
+        """Take a token and return how long to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._tokens = min(
+                self._burst, self._tokens + elapsed * self._rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            paced = max(0.0, -self._tokens / self._rate)
+            blocked = max(0.0, self._blocked_until - now)
+            wait = max(paced, blocked)
+            if wait:
+                wait += random.uniform(0, self._jitter * wait)
+                if blocked > paced:
+                    self.throttled_seconds += wait
+                else:
+                    self.paced_seconds += wait
+            return wait
+
+    def acquire(self) -> None:
+        """Block until the next request may be sent."""
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        """Wait without blocking the event loop until a request may be sent."""
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+    def on_success(self, latency: float) -> None:
+        """Adjust the rate after a successful request of the given latency."""
+        with self._lock:
+            self.requests += 1
+            if latency > self._target_latency:
+                self._rate = max(self._min_rate, self._rate * 0.9)
+            else:
+                self._rate = min(self._max_rate, self._rate + 0.1)
+
+    def on_throttle(self, retry_after: float | None = None) -> None:
+        """
+        Slow down after a throttled request, blocking every caller for
+        `retry_after` seconds, or one token interval if it is not known.
+        """
+        with self._lock:
+            self.requests += 1
+            self.throttles += 1
+            self._rate = max(self._min_rate, self._rate / 2)
+            if retry_after is None:
+                retry_after = 1 / self._rate
+            now = time.monotonic()
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+            self._tokens = min(self._tokens, 0.0)
+
+    def stats(self) -> dict:
+        """Return the request, throttle and wait counters."""
+        return {
+            "rate": self._rate,
+            "requests": self.requests,
+            "throttles": self.throttles,
+            "throttled_seconds": self.throttled_seconds,
+            "paced_seconds": self.paced_seconds,
+        }
@@ -0,0 +1,114 @@
+from bisect import bisect_right
+from os import makedirs, path
+import hashlib
+import json
+import zlib
+
+
+class ResponseCache:
+    """
+    Append-only on-disk store of raw API pages, keyed by a hash of the query
+    and the offset each page was fetched at.
+
+    Pages are zlib-compressed JSON appended to `pages.dat`; `index.jsonl`
+    records the position, length, node count and total count of each one.
+    An index line is only written once its page is on disk, so a page cut
+    short by a crash is never read back. A page recorded again at the same
+    offset replaces the earlier one.
+    """
+
+    DATA_FILE = "pages.dat"
+    INDEX_FILE = "index.jsonl"
+
+    def __init__(self, directory: str, compression_level: int = 6):
+        """Open the store in `directory`, creating it if needed."""
+        makedirs(directory, exist_ok=True)
+        self._data_path = path.join(directory, self.DATA_FILE)
+        self._index_path = path.join(directory, self.INDEX_FILE)
+        self._compression_level = compression_level
+        self._index = {}
+        self._offsets = {}
+        self.recorded = 0
+        self.replayed = 0
+        self._load_index()
+
+    @staticmethod
+    def query_key(query: str) -> str:
+        """Return the key of a query, ignoring differences in whitespace."""
+        normalized = " ".join(query.split())
+        return hashlib.sha256(normalized.encode()).hexdigest()[:16]
+
+    def _load_index(self) -> None:
+        if not path.exists(self._index_path):
+            return
+        size = (
+            path.getsize(self._data_path)
+            if path.exists(self._data_path)
+            else 0
+        )
+        with open(self._index_path) as index:
+            for line in index:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry["position"] + entry["length"] <= size:
+                    self._add(entry)
+
+    def _add(self, entry: dict) -> None:
+        key = (entry["query"], entry["offset"])
+        if key not in self._index:
+            offsets = self._offsets.setdefault(entry["query"], [])
+            offsets.insert(
+                bisect_right(offsets, entry["offset"]), entry["offset"]
+            )
+        self._index[key] = entry
+
+    def put(self, query_key: str, offset: int, response: dict) -> None:
+        """Append the raw response of the page fetched at `offset`."""
+        data = zlib.compress(
+            json.dumps(response, separators=(",", ":")).encode(),
+            self._compression_level,
+        )
+        listing = response["getProductListing"]
+        with open(self._data_path, "ab") as pages:
+            position = pages.tell()
+            pages.write(data)
+        entry = {
+            "query": query_key,
+            "offset": offset,
+            "nodes": len(listing.get("edges", [])),
+            "total_count": listing.get("totalCount"),
+            "position": position,
+            "length": len(data),
+        }
+        with open(self._index_path, "a") as index:
+            index.write(json.dumps(entry) + "\n")
+        self._add(entry)
+        self.recorded += 1
+
+    def find(self, query_key: str, offset: int) -> tuple[int, dict] | None:
+        """
+        Return the offset and raw response of the stored page that contains
+        the node at `offset`, or `None` if no stored page covers it.
+        """
+        offsets = self._offsets.get(query_key, [])
+        at = bisect_right(offsets, offset) - 1
+        if at < 0:
+            return None
+        entry = self._index[(query_key, offsets[at])]
+        if offset >= entry["offset"] + max(entry["nodes"], 1):
+            return None
+        with open(self._data_path, "rb") as pages:
+            pages.seek(entry["position"])
+            data = pages.read(entry["length"])
+        self.replayed += 1
+        return entry["offset"], json.loads(zlib.decompress(data))
+
+    def stats(self) -> dict:
+        """Return the number of stored, recorded and replayed pages."""
+        return {
+            "pages": len(self._index),
+            "recorded": self.recorded,
+            "replayed": self.replayed,
+        }